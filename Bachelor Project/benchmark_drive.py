@@ -0,0 +1,53 @@
+import time
+
+from drive_storage import build_folder_map, clear_folders
+from fake_drive import FakeDriveService
+
+
+ROUND_TRIP_LATENCY = 0.05
+FILES_PER_SLOT = 1
+SLOT_COUNTS = [1, 12, 24]
+LAYER_COUNT = 2
+
+
+def quiet(message):
+    pass
+
+
+def clear_one_by_one(service, folder_ids):
+    # What the drop path used to do: check each folder, then list and delete file by file
+    for folder_id in folder_ids:
+        query = f"'{folder_id}' in parents and trashed=false"
+        items = service.files().list(q=query, fields="files(id)").execute().get('files', [])
+        if items:
+            items = service.files().list(q=query, fields="files(id)").execute().get('files', [])
+            for item in items:
+                service.files().delete(fileId=item['id']).execute()
+
+
+def run(clear, slot_count):
+    service = FakeDriveService()
+    folder_map = build_folder_map(service, LAYER_COUNT, quiet)
+    folder_ids = [folder_id for layers in folder_map.values() for folder_id in layers.values()][:slot_count]
+    for folder_id in folder_ids:
+        for i in range(FILES_PER_SLOT):
+            service.add_file(f'box {i}.png', [folder_id])
+
+    service.latency = ROUND_TRIP_LATENCY
+    service.round_trips = 0
+    start = time.perf_counter()
+    clear(service, folder_ids)
+    elapsed = time.perf_counter() - start
+
+    assert not any(set(file['parents']) & set(folder_ids) for file in service.file_table.values())
+    return service.round_trips, elapsed
+
+
+if __name__ == '__main__':
+    print(f'Simulated round trip: {ROUND_TRIP_LATENCY * 1000:.0f} ms, {FILES_PER_SLOT} file(s) per slot')
+    print('{:>6} {:>22} {:>22}'.format('slots', 'one by one', 'batched'))
+    for slot_count in SLOT_COUNTS:
+        legacy = run(clear_one_by_one, slot_count)
+        batched = run(lambda service, folder_ids: clear_folders(folder_ids, service, quiet), slot_count)
+        print('{:>6} {:>6} trips {:>7.0f} ms {:>6} trips {:>7.0f} ms'.format(
+            slot_count, legacy[0], legacy[1] * 1000, batched[0], batched[1] * 1000))
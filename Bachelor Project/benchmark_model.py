@@ -0,0 +1,45 @@
+import glob
+import os
+import time
+
+import numpy as np
+
+from forest_export import load_model
+
+
+REPEATS = 5
+
+
+def benchmark(path, x_test, y_test):
+    start = time.perf_counter()
+    model = load_model(path)
+    load_ms = 1000 * (time.perf_counter() - start)
+
+    accuracy = np.mean(model.predict(x_test) == y_test)
+
+    latencies = []
+    for _ in range(REPEATS):
+        for row in x_test:
+            start = time.perf_counter()
+            model.predict([row])
+            latencies.append(time.perf_counter() - start)
+    latencies = 1000 * np.array(latencies)
+
+    return {
+        'model': path,
+        'size_kb': os.path.getsize(path) / 1024,
+        'load_ms': load_ms,
+        'accuracy': accuracy * 100,
+        'p50_ms': np.percentile(latencies, 50),
+        'p99_ms': np.percentile(latencies, 99),
+    }
+
+
+split = np.load('test_split.npz')
+x_test, y_test = split['x_test'], split['y_test']
+
+rows = [benchmark(path, x_test, y_test) for path in ['model.p'] + sorted(glob.glob('model*.npz'))]
+
+print('{:<18} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('model', 'size KB', 'load ms', 'accuracy', 'p50 ms', 'p99 ms'))
+for row in rows:
+    print('{model:<18} {size_kb:>10.1f} {load_ms:>10.2f} {accuracy:>9.2f}% {p50_ms:>10.3f} {p99_ms:>10.3f}'.format(**row))
@@ -0,0 +1,90 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from drive_backend import DriveBackend, fake_drive_backend
+from storage_backend import PHALANGE_COUNT, LocalDiskBackend
+
+
+ROUND_TRIP_LATENCY = 0.05
+LAYER_COUNT = 2
+ROUNDS = 5
+BOX_SIZE = 200 * 1024
+
+
+def quiet(message):
+    # Per-file Drive messages would drown the table; failures are counted after each run
+    pass
+
+
+def percentiles(samples):
+    samples = np.array(samples) * 1000
+    return np.percentile(samples, 50), np.percentile(samples, 99)
+
+
+def run(backend, box_paths):
+    # Each round fills every slot of every layer, peeks them all, then clears the layers.
+    # Call latencies are what the frame loop pays; the total includes waiting for
+    # background writes to land.
+    backend.start()
+    while not backend.ready():
+        time.sleep(0.01)
+    latencies = {'place': [], 'peek': [], 'list': [], 'clear': []}
+    start = time.perf_counter()
+    for round_index in range(ROUNDS):
+        for layer in range(1, LAYER_COUNT + 1):
+            for phalange in range(1, PHALANGE_COUNT + 1):
+                t = time.perf_counter()
+                backend.place(phalange, layer, box_paths[(phalange + round_index) % len(box_paths)])
+                latencies['place'].append(time.perf_counter() - t)
+                backend.poll()
+        backend.drain()
+        for layer in range(1, LAYER_COUNT + 1):
+            for phalange in range(1, PHALANGE_COUNT + 1):
+                t = time.perf_counter()
+                backend.peek(phalange, layer)
+                latencies['peek'].append(time.perf_counter() - t)
+            t = time.perf_counter()
+            occupied = backend.list(layer)
+            latencies['list'].append(time.perf_counter() - t)
+            t = time.perf_counter()
+            backend.clear(occupied)
+            latencies['clear'].append(time.perf_counter() - t)
+        backend.drain()
+    elapsed = time.perf_counter() - start
+    backend.stop()
+    failed = len(backend.worker.failed) if isinstance(backend, DriveBackend) else 0
+    if failed:
+        print(f'{failed} Drive operations failed')
+    operations = sum(len(samples) for samples in latencies.values())
+    return latencies, operations / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the storage backends')
+    parser.add_argument('--drive', action='store_true', help='also run against the real Google Drive account')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        box_paths = []
+        for i in range(3):
+            box_paths.append(os.path.join(root, f'box {i}.png'))
+            with open(box_paths[-1], 'wb') as f:
+                f.write(os.urandom(BOX_SIZE))
+
+        backends = [('local disk', lambda: LocalDiskBackend(LAYER_COUNT, os.path.join(root, 'local'))),
+                    (f'fake drive ({ROUND_TRIP_LATENCY * 1000:.0f} ms)', lambda: fake_drive_backend(LAYER_COUNT, ROUND_TRIP_LATENCY, quiet))]
+        if args.drive:
+            backends.append(('google drive', lambda: DriveBackend(LAYER_COUNT, log=quiet)))
+
+        print(f'{ROUNDS} rounds of {LAYER_COUNT * PHALANGE_COUNT} placements, peeks and a clear per layer')
+        print('{:<20} {:>16} {:>16} {:>16} {:>16} {:>10}'.format(
+            'backend', 'place p50/p99', 'peek p50/p99', 'list p50/p99', 'clear p50/p99', 'ops/s'))
+        for name, make_backend in backends:
+            latencies, throughput = run(make_backend(), box_paths)
+            columns = ['{:>7.3f}/{:<8.3f}'.format(*percentiles(latencies[op])) for op in ('place', 'peek', 'list', 'clear')]
+            print('{:<20} {} {:>10.0f}'.format(name, ' '.join(columns), throughput))
+        print('latencies in ms')
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from drive_backend import fake_drive_backend
+from features import landmarks_to_array, normalized_features
+from forest_export import load_model
+from frame_scaling import FrameDownscaler
+from gesture_controller import GestureController
+from gesture_inference import STAGES, FrameProcessor, StageTimer
+from gesture_labels import DEFAULT_LABELS, load_labels
+from metrics import EventLog, Metrics
+from overlay import CursorCompositor
+from pipeline import GesturePipeline
+from prediction_cache import PredictionCache
+from recording import FrameClock, replay_captures
+from storage_backend import PHALANGE_COUNT, LocalDiskBackend
+from touch import TouchDetector
+
+
+MICRO_FRAMES = 5000
+DISPLAY_WIDTH = 1280
+LAYER_COUNT = 2
+# Fraction of synthetic frames where the hand jumps to a new pose instead of jittering
+POSE_CHANGE_RATE = 0.05
+# The gesture logic alternates between this many frames of one hand and of two hands
+HAND_PHASE_FRAMES = 60
+# A stage is flagged when its p95 is this much slower than in the baseline file
+REGRESSION_TOLERANCE = 1.2
+
+
+def summarize(samples):
+    ms = 1000 * np.asarray(samples, dtype=np.float64)
+    if not len(ms):
+        return None
+    return {'n': int(len(ms)), 'mean_ms': float(ms.mean()),
+            'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99))}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def synthetic_hands(rng, frames):
+    # Random-walk landmark sets: mostly small jitter, with occasional jumps to a new pose
+    hands = []
+    pose = rng.uniform(0.3, 0.7, (2, 21, 3)).astype(np.float32)
+    for _ in range(frames):
+        if rng.random() < POSE_CHANGE_RATE:
+            pose = rng.uniform(0.3, 0.7, (2, 21, 3)).astype(np.float32)
+        pose = pose + rng.normal(0, 0.002, pose.shape).astype(np.float32)
+        hands.append(pose.copy())
+    return hands
+
+
+def to_landmarks(points):
+    return SimpleNamespace(landmark=[SimpleNamespace(x=float(x), y=float(y), z=float(z)) for x, y, z in points])
+
+
+def micro_benchmark(model, frames, seed=0, labels=None):
+    # Everything after MediaPipe, on synthetic landmarks: one hand for classification,
+    # both hands for touch detection, Main.py's gesture logic (GestureController, fed one
+    # hand and its prediction or both hands and their touch in alternating phases), then
+    # the storage check and the cursor window render
+    rng = np.random.default_rng(seed)
+    hands = synthetic_hands(rng, frames)
+    landmark_objects = [to_landmarks(pair[0]) for pair in hands]
+    classify = PredictionCache(model.predict)
+    touch_detector = TouchDetector(pointer_hand=None)
+    compositor = CursorCompositor()
+    boxes = [(100, 100, (255, 255, 255), 'Box 1'), (300, 200, (255, 255, 255), 'Box 2')]
+    # What Main.py records per rendered frame with metrics on: the stage, render and frame age histograms
+    metrics = Metrics()
+    frame_histograms = list(metrics.stage_times('cam0.', STAGES).values()) + [
+        metrics.histogram('render'), metrics.histogram('capture_to_render')]
+    stage_times = {stage: [] for stage in ['features', 'predict', 'classify_cached', 'touch', 'gesture_logic',
+                                           'storage_local', 'storage_fake_drive', 'cursor_render', 'metrics']}
+    end_to_end = []
+
+    with tempfile.TemporaryDirectory() as root, open(os.devnull, 'w') as devnull:
+        # Logs like Main.py, through an event log, but to nowhere
+        events = EventLog(stream=devnull)
+        local = LocalDiskBackend(LAYER_COUNT, os.path.join(root, 'local'))
+        drive = fake_drive_backend(LAYER_COUNT, log=events.log)
+        drive.occupancy.sweep()
+        box_file = os.path.join(root, 'box.bin')
+        with open(box_file, 'wb') as f:
+            f.write(os.urandom(1024))
+        clock = FrameClock(0.0)
+        controller = GestureController(local, lambda current: drive if current is local else local, clock,
+                                       labels or DEFAULT_LABELS, [('Box 1', box_file), ('Box 2', box_file)],
+                                       LAYER_COUNT, log=events.log,
+                                       rng=random.Random(seed))
+        frame_time = 0.0
+        for i, (pair, landmarks) in enumerate(zip(hands, landmark_objects)):
+            frame_time += 1 / 30
+            phalange = 1 + i % PHALANGE_COUNT
+            timer = StageTimer(stage_times)
+            start = timer.last
+            lap = timer.lap
+
+            features = normalized_features(landmarks_to_array(landmarks))
+            lap('features')
+            prediction = model.predict([features])
+            lap('predict')
+            classify(features, frame_time)
+            lap('classify_cached')
+            touch = touch_detector.update(list(pair))
+            lap('touch')
+            clock.advance(frame_time)
+            if (i // HAND_PHASE_FRAMES) % 2:
+                controller.update(list(pair), None, touch, 640, 480)
+            else:
+                controller.update([pair[0]], prediction, None, 640, 480)
+            lap('gesture_logic')
+            local.peek(phalange, 1)
+            lap('storage_local')
+            drive.peek(phalange, 1)
+            lap('storage_fake_drive')
+            cursor = (int(pair[0, 8, 0] * 640), int(pair[0, 8, 1] * 480))
+            compositor.render(boxes, cursor)
+            lap('cursor_render')
+            for histogram in frame_histograms:
+                histogram.append(0.001)
+            lap('metrics')
+            end_to_end.append(timer.last - start)
+        drive.stop()
+
+    # The cached path replaces predict in the app, so it is not counted twice
+    end_to_end = np.array(end_to_end) - np.array(stage_times['predict'])
+    total = float(np.sum(end_to_end))
+    return {
+        'frames': frames,
+        'stages': {stage: summarize(samples) for stage, samples in stage_times.items()},
+        'end_to_end': summarize(end_to_end),
+        'fps': frames / total if total else None,
+        'classify_cache_hit_rate': classify.hit_rate(),
+    }
+
+
+class TimedCapture:
+    # Remembers when each replayed frame was read so results can be timed end to end
+    def __init__(self, cap):
+        self.cap = cap
+        self.read_at = {}
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+    def read(self):
+        start = time.perf_counter()
+        ret, frame = self.cap.read()
+        if ret:
+            self.read_at[self.cap.frame_time] = start
+        return ret, frame
+
+
+def macro_benchmark(model, clip, camera_count=2):
+    # The clip through GesturePipeline with the app's FrameProcessor (lossless, as fast as
+    # possible), plus the render work of every rendered frame: display copy, landmark
+    # drawing, touch detection and the cursor window
+    caps = [TimedCapture(cap) for cap in replay_captures(clip, camera_count)]
+    stage_times = [{} for _ in caps]
+    pipeline = GesturePipeline(caps, lambda index: FrameProcessor(model, stage_times=stage_times[index]),
+                               lossless=True)
+    display_scale = FrameDownscaler(DISPLAY_WIDTH, rgb=False, interpolation=cv2.INTER_LINEAR)
+    touch_detector = TouchDetector()
+    compositor = CursorCompositor()
+    mp_drawing = mp.solutions.drawing_utils
+    render_times, end_to_end = [], []
+
+    start = time.perf_counter()
+    pipeline.start()
+    while True:
+        item = pipeline.get()
+        if item is None:
+            if pipeline.finished:
+                break
+            continue
+        cap, frame, (results, hand_points, prediction), frame_time = item
+        render_start = time.perf_counter()
+        display = display_scale(frame)
+        for hand_landmarks in results.multi_hand_landmarks:
+            mp_drawing.draw_landmarks(display, hand_landmarks, mp.solutions.hands.HAND_CONNECTIONS)
+        handedness = [hand.classification[0].label for hand in results.multi_handedness or []]
+        touch_detector.update(hand_points, handedness)
+        tip = hand_points[0][8]
+        compositor.render([], (int(tip[0] * 640), int(tip[1] * 480)))
+        now = time.perf_counter()
+        render_times.append(now - render_start)
+        end_to_end.append(now - cap.read_at[frame_time])
+    elapsed = time.perf_counter() - start
+    pipeline.stop()
+    for cap in caps:
+        cap.release()
+
+    stages = {}
+    for stage in STAGES:
+        samples = [sample for times in stage_times for sample in times.get(stage, [])]
+        stages[stage] = summarize(samples)
+    stages['render'] = summarize(render_times)
+    frames = sum(len(cap.read_at) for cap in caps)
+    return {
+        'clip': os.path.abspath(clip),
+        'frames_read': frames,
+        'frames_rendered': len(end_to_end),
+        'stages': stages,
+        'end_to_end': summarize(end_to_end),
+        'fps': frames / elapsed if elapsed else None,
+        'rendered_fps': len(end_to_end) / elapsed if elapsed else None,
+    }
+
+
+def regressions(report, baseline):
+    found = []
+    for suite in ('micro', 'macro'):
+        if not report.get(suite) or not baseline.get(suite):
+            continue
+        current = dict(report[suite]['stages'], end_to_end=report[suite]['end_to_end'])
+        previous = dict(baseline[suite]['stages'], end_to_end=baseline[suite]['end_to_end'])
+        for stage, stats in current.items():
+            if stats and previous.get(stage) and stats['p95_ms'] > REGRESSION_TOLERANCE * previous[stage]['p95_ms']:
+                found.append(f"{suite} {stage}: p95 {previous[stage]['p95_ms']:.3f} -> {stats['p95_ms']:.3f} ms")
+    return found
+
+
+def print_suite(name, suite):
+    print(f"{name}: {suite['fps']:.1f} fps, peak RSS {suite['peak_rss_mb']:.0f} MB")
+    rows = dict(suite['stages'], end_to_end=suite['end_to_end'])
+    for stage, stats in rows.items():
+        if stats:
+            print('  {:<20} p50 {:>8.3f}  p95 {:>8.3f}  p99 {:>8.3f} ms'.format(
+                stage, stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-stage and end-to-end latency benchmarks')
+    parser.add_argument('--model', default='./model.npz' if os.path.exists('./model.npz') else './model.p')
+    parser.add_argument('--clip', metavar='DIR', help='recording (Main.py --record) for the macro benchmark')
+    parser.add_argument('--frames', type=int, default=MICRO_FRAMES, help='synthetic frames for the micro benchmark')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier output file to check for p95 regressions')
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'model': args.model,
+    }
+    # ru_maxrss is the process high-water mark and cannot be reset, so each suite records
+    # it when it finishes: the micro figure is the micro suite's peak, the macro figure
+    # (run second) the peak over both suites
+    report['micro'] = micro_benchmark(model, args.frames, labels=load_labels(args.model))
+    report['micro']['peak_rss_mb'] = peak_rss_mb()
+    report['macro'] = None
+    if args.clip:
+        report['macro'] = macro_benchmark(model, args.clip)
+        report['macro']['peak_rss_mb'] = peak_rss_mb()
+
+    print_suite('micro (synthetic landmarks)', report['micro'])
+    if report['macro']:
+        print_suite(f"macro ({report['macro']['clip']})", report['macro'])
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f))
+        for line in found:
+            print(f'REGRESSION {line}')
+        sys.exit(1 if found else 0)
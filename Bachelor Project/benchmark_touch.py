@@ -0,0 +1,91 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from features import FINGER_LANDMARKS, FINGER_PRIORITY, INDEX_FINGER_TIP
+from touch import PHALANGE_PARTS, TouchDetector
+
+
+FRAMES = 20000
+JITTER_FRAMES = 2000
+THRESHOLD = 0.1
+
+
+def legacy_touch(left_hand, right_hand):
+    # The nested loop Main used before TouchDetector
+    left_index_tip = left_hand.landmark[INDEX_FINGER_TIP]
+    for finger_name in FINGER_PRIORITY:
+        for i, phalange_landmark in enumerate(FINGER_LANDMARKS[finger_name]):
+            fingertip = right_hand.landmark[phalange_landmark]
+            distance = np.linalg.norm([
+                left_index_tip.x - fingertip.x,
+                left_index_tip.y - fingertip.y,
+                left_index_tip.z - fingertip.z
+            ])
+            if distance < THRESHOLD:
+                return finger_name, PHALANGE_PARTS[i], fingertip
+    return None
+
+
+def to_landmarks(points):
+    return SimpleNamespace(landmark=[SimpleNamespace(x=float(x), y=float(y), z=float(z)) for x, y, z in points])
+
+
+def random_hands(rng):
+    return [rng.uniform(0, 1, (21, 3)).astype(np.float32) * [1, 1, 0.1] for _ in range(2)]
+
+
+def time_per_frame(detect, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        detect(frame)
+    return 1e6 * (time.perf_counter() - start) / len(frames)
+
+
+def jittery_touch(rng):
+    # The left index tip hovers right at the threshold of the right index tip, with tracking noise
+    frames = []
+    for _ in range(JITTER_FRAMES):
+        left, right = random_hands(rng)
+        right[:, :2] += 3  # only the index tip is near
+        right[8] = [0.5, 0.5, 0.0]
+        left[INDEX_FINGER_TIP] = right[8] + [THRESHOLD + rng.normal(0, 0.01), 0, 0]
+        frames.append([left, right])
+    return frames
+
+
+def legacy_agreement(detector, hands, legacy_frames):
+    # Frames where a fresh detection picks the same target as the old loop
+    same = 0
+    for points, frame in zip(hands, legacy_frames):
+        touch = detector.detect(points, ['Left', 'Right'])
+        legacy = legacy_touch(*frame)
+        same += (touch.target if touch else None) == (f'{legacy[1]} {legacy[0].split()[0].lower()}' if legacy else None)
+    return same
+
+
+def count_touch_starts(touches):
+    return sum(1 for previous, current in zip([None] + touches, touches) if current and not previous)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    hands = [random_hands(rng) for _ in range(FRAMES)]
+    legacy_frames = [(to_landmarks(left), to_landmarks(right)) for left, right in hands]
+    detector = TouchDetector(pointer_hand=None, debounce_frames=1)
+
+    legacy_us = time_per_frame(lambda frame: legacy_touch(*frame), legacy_frames)
+    vectorized_us = time_per_frame(detector.update, hands)
+    print(f'{FRAMES} random two-hand frames')
+    print(f'legacy loop:   {legacy_us:7.1f} us/frame')
+    print(f'TouchDetector: {vectorized_us:7.1f} us/frame (both hands, {len(detector.target_names)} targets each)')
+    agreement = legacy_agreement(TouchDetector(enter_threshold=THRESHOLD), hands, legacy_frames)
+    print(f'same target as the legacy loop on {agreement}/{FRAMES} frames')
+
+    frames = jittery_touch(rng)
+    raw = [legacy_touch(to_landmarks(left), to_landmarks(right)) is not None for left, right in frames]
+    detector = TouchDetector(pointer_hand=None)
+    debounced = [detector.update(frame) is not None for frame in frames]
+    print(f'{JITTER_FRAMES} frames hovering at the threshold: {count_touch_starts(raw)} touch starts without '
+          f'hysteresis, {count_touch_starts(debounced)} with hysteresis and debouncing')
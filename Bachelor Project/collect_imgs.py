@@ -1,39 +1,176 @@
+import argparse
 import os
+import queue
+import threading
+import time
 
 import cv2
+import mediapipe as mp
+
+from feature_store import FeatureStore, write_dataset
+from features import landmarks_to_array, normalized_features
+from frame_scaling import FrameDownscaler
 
 
 DATA_DIR = './data'
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
+# Frames saved while streaming; kept out of DATA_DIR so create_dataset.py does not add them a second time
+CAPTURE_DIR = './captures'
+FEATURE_STORE_DIR = './features'
+INFERENCE_WIDTH = 640
+JPEG_QUALITY = 90
+VIDEO_FOURCC = 'MJPG'
+VIDEO_FPS = 30
 
 number_of_classes = 5
 dataset_size = 200
 
-cap = cv2.VideoCapture(1)
-for j in range(number_of_classes):
-    if not os.path.exists(os.path.join(DATA_DIR, str(j))):
-        os.makedirs(os.path.join(DATA_DIR, str(j)))
 
-    print('Collecting data for class {}'.format(j))
+class FrameWriter:
+    # Encodes and writes frames on a background thread so collection runs at the camera
+    # rate. 'jpg' writes <directory>/<name>.jpg, 'video' appends to <directory>.avi.
+    # The queue is bounded: if the disk really falls behind, put() waits rather than
+    # dropping frames.
+    def __init__(self, mode, maxsize=64):
+        self.mode = mode
+        self.written = 0
+        self._videos = {}
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name='frame-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, directory, name, frame):
+        self._queue.put((directory, name, frame))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            directory, name, frame = item
+            if self.mode == 'video':
+                writer = self._videos.get(directory)
+                if writer is None:
+                    os.makedirs(os.path.dirname(directory) or '.', exist_ok=True)
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(directory + '.avi', cv2.VideoWriter_fourcc(*VIDEO_FOURCC),
+                                             VIDEO_FPS, (width, height))
+                    self._videos[directory] = writer
+                writer.write(frame)
+            else:
+                cv2.imwrite(os.path.join(directory, '{}.jpg'.format(name)), frame,
+                            [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            self.written += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        for writer in self._videos.values():
+            writer.release()
+
 
-    done = False
+def wait_until_ready(cap):
     while True:
         ret, frame = cap.read()
+        if not ret:
+            continue
         cv2.putText(frame, 'Ready? Press "Q" ! :)', (100, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.3, (0, 255, 0), 3,
                     cv2.LINE_AA)
         cv2.imshow('frame', frame)
         if cv2.waitKey(25) == ord('q'):
             break
 
+
+def collect_images(cap, label, writer):
+    class_dir = os.path.join(DATA_DIR, label)
+    os.makedirs(class_dir, exist_ok=True)
     counter = 0
     while counter < dataset_size:
         ret, frame = cap.read()
+        if not ret:
+            continue
         cv2.imshow('frame', frame)
-        cv2.waitKey(25)
-        cv2.imwrite(os.path.join(DATA_DIR, str(j), '{}.jpg'.format(counter)), frame)
-
+        cv2.waitKey(1)
+        writer.put(class_dir, counter, frame)
         counter += 1
 
-cap.release()
-cv2.destroyAllWindows()
+
+def stream_landmarks(cap, label, hands, downscale, store, session, writer=None):
+    # Only frames where MediaPipe finds a hand count towards dataset_size; their features
+    # go straight into the feature store under stream/<label>/<session>/<n>
+    if writer is not None and writer.mode == 'video':
+        target = os.path.join(CAPTURE_DIR, '{}_{}'.format(label, session))
+    else:
+        target = os.path.join(CAPTURE_DIR, label)
+        if writer is not None:
+            os.makedirs(target, exist_ok=True)
+    counter = 0
+    frames = 0
+    while counter < dataset_size:
+        ret, frame = cap.read()
+        if not ret:
+            continue
+        frames += 1
+        results = hands.process(downscale(frame))
+        if results.multi_hand_landmarks:
+            features = normalized_features(landmarks_to_array(results.multi_hand_landmarks[0]))
+            store.add('stream/{}/{}/{:05d}'.format(label, session, counter), features, label)
+            if writer is not None:
+                # The writer thread gets its own copy; the counter is drawn on `frame` below
+                writer.put(target, '{}_{:05d}'.format(session, counter), frame.copy())
+            counter += 1
+        cv2.putText(frame, '{}/{}'.format(counter, dataset_size), (100, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.3,
+                    (0, 255, 0), 3, cv2.LINE_AA)
+        cv2.imshow('frame', frame)
+        cv2.waitKey(1)
+    return frames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect training data for the gesture classifier')
+    parser.add_argument('--stream', action='store_true',
+                        help='run hand landmarking live and add features to the feature store instead of writing JPEGs '
+                             'for create_dataset.py')
+    parser.add_argument('--save', choices=['none', 'jpg', 'video'], default='none',
+                        help='with --stream, also keep the frames that had a hand, as JPEGs or one video per class '
+                             'in {}'.format(CAPTURE_DIR))
+    parser.add_argument('--camera', type=int, default=1)
+    parser.add_argument('--classes', type=int, default=number_of_classes)
+    parser.add_argument('--first-class', type=int, default=0, help='label of the first class to collect')
+    parser.add_argument('--size', type=int, default=dataset_size, help='samples per class')
+    args = parser.parse_args()
+    dataset_size = args.size
+
+    cap = cv2.VideoCapture(args.camera)
+    if args.stream:
+        hands = mp.solutions.hands.Hands(static_image_mode=False, max_num_hands=1, min_detection_confidence=0.3)
+        downscale = FrameDownscaler(INFERENCE_WIDTH)
+        store = FeatureStore(FEATURE_STORE_DIR)
+        session = time.strftime('%Y%m%d-%H%M%S')
+        writer = FrameWriter(args.save) if args.save != 'none' else None
+    else:
+        writer = FrameWriter('jpg')
+
+    for j in range(args.first_class, args.first_class + args.classes):
+        label = str(j)
+        print('Collecting data for class {}'.format(j))
+        wait_until_ready(cap)
+
+        start = time.perf_counter()
+        if args.stream:
+            frames = stream_landmarks(cap, label, hands, downscale, store, session, writer)
+            store.flush()
+        else:
+            collect_images(cap, label, writer)
+            frames = dataset_size
+        elapsed = time.perf_counter() - start
+        print('Class {}: {} samples from {} frames in {:.1f} s ({:.1f} fps)'.format(
+            j, dataset_size, frames, elapsed, frames / max(elapsed, 1e-9)))
+
+    cap.release()
+    cv2.destroyAllWindows()
+    if writer is not None:
+        writer.close()
+    if args.stream:
+        # The training set is up to date without a create_dataset.py pass
+        write_dataset(store)
+        print('Feature store and data.pickle updated')
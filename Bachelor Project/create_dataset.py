@@ -1,53 +1,64 @@
 import os
-import pickle
+from multiprocessing import Pool
 
 import mediapipe as mp
 import cv2
-import matplotlib.pyplot as plt
 
+from features import landmarks_to_array, normalized_features
+from feature_store import FeatureStore, write_dataset
 
-mp_hands = mp.solutions.hands
-mp_drawing = mp.solutions.drawing_utils
-mp_drawing_styles = mp.solutions.drawing_styles
-
-hands = mp_hands.Hands(static_image_mode=True, min_detection_confidence=0.3)
 
 DATA_DIR = './data'
+FEATURE_STORE_DIR = './features'
+
+hands = None
+
+
+def init_worker():
+    global hands
+    hands = mp.solutions.hands.Hands(static_image_mode=True, min_detection_confidence=0.3)
+
+
+def extract_features(job):
+    path, label, mtime = job
+    img = cv2.imread(path)
+    if img is None:
+        return path, None, label, mtime
+
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    results = hands.process(img_rgb)
+    if not results.multi_hand_landmarks:
+        return path, None, label, mtime
+    return path, normalized_features(landmarks_to_array(results.multi_hand_landmarks[0])), label, mtime
+
+
+def list_images():
+    images = []
+    for dir_ in sorted(os.listdir(DATA_DIR)):
+        # Skip the file if it's not a directory
+        if not os.path.isdir(os.path.join(DATA_DIR, dir_)):
+            continue
+        for img_path in sorted(os.listdir(os.path.join(DATA_DIR, dir_))):
+            path = os.path.join(DATA_DIR, dir_, img_path)
+            images.append((path, dir_, os.path.getmtime(path)))
+    return images
+
+
+if __name__ == '__main__':
+    store = FeatureStore(FEATURE_STORE_DIR)
+    images = list_images()
+
+    on_disk = {path for path, _, _ in images}
+    for key, entry in list(store.entries.items()):
+        if 'mtime' in entry and key not in on_disk:
+            store.remove(key)
+
+    jobs = [job for job in images if not store.is_current(job[0], job[2])]
+    print('{} of {} images are new or changed'.format(len(jobs), len(images)))
 
-data = []
-labels = []
-for dir_ in os.listdir(DATA_DIR):
-    # Skip the file if it's not a directory
-    if not os.path.isdir(os.path.join(DATA_DIR, dir_)):
-        continue
-    for img_path in os.listdir(os.path.join(DATA_DIR, dir_)):
-        data_aux = []
-
-        x_ = []
-        y_ = []
-
-        img = cv2.imread(os.path.join(DATA_DIR, dir_, img_path))
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        results = hands.process(img_rgb)
-        if results.multi_hand_landmarks:
-            for hand_landmarks in results.multi_hand_landmarks:
-                for i in range(len(hand_landmarks.landmark)):
-                    x = hand_landmarks.landmark[i].x
-                    y = hand_landmarks.landmark[i].y
-
-                    x_.append(x)
-                    y_.append(y)
-
-                for i in range(len(hand_landmarks.landmark)):
-                    x = hand_landmarks.landmark[i].x
-                    y = hand_landmarks.landmark[i].y
-                    data_aux.append(x - min(x_))
-                    data_aux.append(y - min(y_))
-
-            data.append(data_aux)
-            labels.append(dir_)
-
-f = open('data.pickle', 'wb')
-pickle.dump({'data': data, 'labels': labels}, f)
-f.close()
+    if jobs:
+        with Pool(initializer=init_worker) as pool:
+            for path, features, label, mtime in pool.imap_unordered(extract_features, jobs, chunksize=16):
+                store.add(path, features, label, mtime)
+    store.flush()
+    write_dataset(store)
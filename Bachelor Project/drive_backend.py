@@ -0,0 +1,159 @@
+import os
+import time
+
+from drive_occupancy import FolderOccupancy
+from drive_storage import build_folder_map, clear_folders, get_drive_service, phalange_folders
+from drive_uploads import UPLOAD_CACHE_PATH, UploadCache, collect_blobs, place_file
+from drive_worker import StorageWorker
+from fake_drive import FakeDriveService
+from storage_backend import StorageBackend
+
+
+class DriveBackend(StorageBackend):
+    # Google Drive slots are the 'phalange N/layer L' folders. Writes go through the
+    # background StorageWorker; peek/list answer from the occupancy index, with slots that
+    # have queued writes reported as they will be once those writes finish. The folder
+    # map (which may have to be built over the network) is loaded by the occupancy
+    # thread, so place/peek/list/clear never call Drive: until the map and the first
+    # sweep are in, slots count as syncing, placements are refused and the status line
+    # says so.
+    name = 'Google Drive'
+    placement_cooldown = 15
+
+    def __init__(self, layer_count, service_factory=get_drive_service, folder_map=None,
+                 upload_cache_path=UPLOAD_CACHE_PATH, log=print, metrics=None):
+        self.layer_count = layer_count
+        self.service_factory = service_factory
+        self.log = log
+        self.folder_map = folder_map or (lambda: phalange_folders(layer_count, log=log))
+        # phalange -> layer -> folder id, set by the occupancy thread once loaded
+        self.folders = None
+        self.worker = StorageWorker(service_factory, log=log,
+                                    failures=metrics.counter('drive.failures') if metrics else None)
+        # Only used from the storage worker thread
+        self.upload_cache = UploadCache(upload_cache_path)
+        self.occupancy = FolderOccupancy(self.load_folder_ids, service_factory, log=log)
+        # folder id -> [has files once queued operations finish, number of queued operations]
+        self.optimistic_slots = {}
+
+    def load_folder_ids(self):
+        # Runs on the occupancy thread
+        if self.folders is None:
+            self.folders = self.folder_map()
+        return [folder_id for layers in self.folders.values() for folder_id in layers.values()]
+
+    def folder_id(self, phalange, layer):
+        # None while the folder map is still loading
+        if self.folders is None:
+            return None
+        return self.folders[f'phalange {phalange}'][f'layer {layer}']
+
+    def start(self):
+        self.occupancy.start()
+
+    def ready(self):
+        return self.folders is not None and self.occupancy.loaded.is_set()
+
+    def poll(self):
+        return self.worker.poll()
+
+    def status_line(self):
+        worker_status = self.worker.status_line()
+        if self.ready():
+            return worker_status
+        syncing = 'Drive: syncing folders'
+        return f'{syncing}; {worker_status[len("Drive: "):]}' if worker_status else syncing
+
+    def drain(self):
+        while self.worker.pending:
+            self.worker.poll()
+            time.sleep(0.005)
+
+    def stop(self):
+        self.worker.stop()
+        self.occupancy.stop()
+
+    def schedule(self, description, run, folder_ids, has_files, on_success, on_failed=None):
+        states = []
+        for folder_id in folder_ids:
+            state = self.optimistic_slots.setdefault(folder_id, [has_files, 0])
+            state[0] = has_files
+            state[1] += 1
+            states.append(state)
+
+        def on_done(operation):
+            if operation.status == 'done':
+                on_success(operation)
+            # Operations finish in submission order, so any still counted on a folder were
+            # queued later and already set its state. Otherwise the state goes and the
+            # occupancy index answers again; a failed write never touched it, which is
+            # what rolls the slot back.
+            for folder_id, state in zip(folder_ids, states):
+                state[1] -= 1
+                if not state[1] and self.optimistic_slots.get(folder_id) is state:
+                    del self.optimistic_slots[folder_id]
+            if operation.status == 'failed' and on_failed is not None:
+                on_failed()
+
+        return self.worker.submit(description, run, on_done)
+
+    def folder_has_files(self, folder_id):
+        # True/False, or None while the folder is not known yet (which also wakes the sweep)
+        if folder_id is None:
+            self.start()
+            return None
+        if folder_id in self.optimistic_slots:
+            return self.optimistic_slots[folder_id][0]
+        has_files = self.occupancy.has_files(folder_id)
+        if has_files is None:
+            self.start()
+        return has_files
+
+    def place(self, phalange, layer, file_path, on_failed=None):
+        folder_id = self.folder_id(phalange, layer)
+        if self.folder_has_files(folder_id) is not False:
+            return False
+        self.schedule(
+            f"upload {os.path.basename(file_path)} to phalange {phalange} in layer {layer}",
+            lambda service: place_file(file_path, folder_id, service, self.upload_cache, self.log),
+            [folder_id], True,
+            lambda operation: self.occupancy.add_file(folder_id, operation.result),
+            on_failed)
+        return True
+
+    def peek(self, phalange, layer):
+        return bool(self.folder_has_files(self.folder_id(phalange, layer)))
+
+    def clear(self, slots):
+        folder_ids = [self.folder_id(phalange, layer) for phalange, layer in slots]
+        folder_ids = [folder_id for folder_id in folder_ids if folder_id is not None]
+        if folder_ids:
+            self.schedule(
+                f"clear {len(folder_ids)} phalanges",
+                lambda service: self.clear_folders(folder_ids, service),
+                folder_ids, False,
+                lambda operation: self.occupancy.clear(folder_ids))
+
+    def clear_folders(self, folder_ids, service):
+        # Runs on the worker thread, which owns the upload cache
+        files = clear_folders(folder_ids, service, self.log)
+        collect_blobs(service, self.upload_cache, [file['id'] for file in files], log=self.log)
+        return files
+
+    def list(self, layer=None):
+        layers = [layer] if layer is not None else range(1, self.layer_count + 1)
+        if self.folders is None:
+            self.start()
+            return []
+        return [(phalange, l) for l in layers for phalange in range(1, len(self.folders) + 1)
+                if self.peek(phalange, l)]
+
+
+def fake_drive_backend(layer_count, latency=0.0, log=print, metrics=None):
+    # DriveBackend on an in-process FakeDriveService, for tests and benchmarks
+    service = FakeDriveService()
+    folder_map = build_folder_map(service, layer_count, log)
+    service.latency = latency
+    backend = DriveBackend(layer_count, lambda: service, lambda: folder_map, None, log, metrics)
+    backend.service = service
+    return backend
@@ -0,0 +1,76 @@
+import threading
+
+from drive_storage import list_files_in_folders
+
+
+class FolderOccupancy:
+    # In-memory folder id -> file ids index for the phalange/layer folders. It is filled
+    # by one batched listing, kept current by our own writes (add_file / clear) and
+    # re-synced by a periodic background sweep, so lookups never touch the network.
+    def __init__(self, folder_ids, service_factory, sweep_interval=30.0, log=print):
+        self.folder_ids = folder_ids
+        self.log = log
+        self.service_factory = service_factory
+        self.sweep_interval = sweep_interval
+        self.loaded = threading.Event()
+        self._files = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='drive-occupancy', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                self.log(f"Drive occupancy sweep failed: {e}")
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
+
+    def sweep(self):
+        with self._lock:
+            version = self._version
+        folder_ids = list(self.folder_ids())
+        files = {folder_id: set() for folder_id in folder_ids}
+        for file in list_files_in_folders(self.service_factory(), folder_ids):
+            for parent in file.get('parents', []):
+                if parent in files:
+                    files[parent].add(file['id'])
+
+        with self._lock:
+            if self._version != version:
+                # One of our own writes landed while listing; retry instead of undoing it
+                self._wake.set()
+                return
+            self._files = files
+        self.loaded.set()
+
+    def has_files(self, folder_id):
+        # None until the folder has been listed at least once
+        files = self._files.get(folder_id)
+        if files is None:
+            self._wake.set()
+            return None
+        return bool(files)
+
+    def add_file(self, folder_id, file_id):
+        with self._lock:
+            self._files.setdefault(folder_id, set()).add(file_id)
+            self._version += 1
+
+    def clear(self, folder_ids):
+        with self._lock:
+            for folder_id in folder_ids:
+                self._files[folder_id] = set()
+            self._version += 1
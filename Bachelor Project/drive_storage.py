@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from google.auth.transport.requests import Request
+
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+CREDENTIALS_FILE = '/Users/adham/Downloads/client_secret_312194384049-ef9dg6go6f2rbvhqtfagbhfnimmf7qpf.apps.googleusercontent.com.json'
+
+ROOT_FOLDER = 'Drag-And-Drop'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+FOLDER_CACHE_PATH = 'drive_folders.json'
+PHALANGE_COUNT = 12
+BATCH_LIMIT = 100
+
+_local = threading.local()
+_credentials_lock = threading.Lock()
+_folder_lock = threading.Lock()
+_folder_map = None
+
+
+def create_drive_service():
+    with _credentials_lock:
+        creds = None
+        if os.path.exists('token.json'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+                creds = flow.run_local_server(port=0)
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+    service = build('drive', 'v3', credentials=creds)
+    return service
+
+
+def get_drive_service():
+    # Built on first use; one client per thread since the underlying httplib2 is not thread-safe
+    service = getattr(_local, 'service', None)
+    if service is None:
+        service = _local.service = create_drive_service()
+    return service
+
+
+def list_folders(service):
+    folders = []
+    page_token = None
+    while True:
+        response = service.files().list(
+            q=f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
+            fields='nextPageToken, files(id, name, parents)',
+            pageSize=1000, pageToken=page_token).execute()
+        folders.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return folders
+
+
+def create_folders(service, folders):
+    # folders: [(name, parent id or None)]; all of them are created with batch requests
+    ids = [None] * len(folders)
+
+    def on_created(request_id, response, exception):
+        if exception is not None:
+            raise exception
+        ids[int(request_id)] = response['id']
+
+    for start in range(0, len(folders), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=on_created)
+        for i in range(start, min(start + BATCH_LIMIT, len(folders))):
+            name, parent = folders[i]
+            body = {'name': name, 'mimeType': FOLDER_MIME_TYPE}
+            if parent:
+                body['parents'] = [parent]
+            batch.add(service.files().create(body=body, fields='id'), request_id=str(i))
+        batch.execute()
+    return ids
+
+
+def build_folder_map(service, layer_count, log=print):
+    folders = list_folders(service)
+    children = {}
+    for folder in folders:
+        for parent in folder.get('parents', []):
+            children.setdefault((parent, folder['name']), folder['id'])
+
+    roots = [folder['id'] for folder in folders if folder['name'] == ROOT_FOLDER]
+    root_id = roots[0] if roots else create_folders(service, [(ROOT_FOLDER, None)])[0]
+
+    phalanges = [f'phalange {i}' for i in range(1, PHALANGE_COUNT + 1)]
+    missing = [(name, root_id) for name in phalanges if (root_id, name) not in children]
+    for (name, parent), folder_id in zip(missing, create_folders(service, missing)):
+        children[(parent, name)] = folder_id
+        log(f"Subfolder '{name}' created.")
+
+    missing = [(f'layer {l}', children[(root_id, phalange)])
+               for phalange in phalanges for l in range(1, layer_count + 1)
+               if (children[(root_id, phalange)], f'layer {l}') not in children]
+    for (name, parent), folder_id in zip(missing, create_folders(service, missing)):
+        children[(parent, name)] = folder_id
+        log(f"Subfolder '{name}' created.")
+
+    return {phalange: {f'layer {l}': children[(children[(root_id, phalange)], f'layer {l}')]
+                       for l in range(1, layer_count + 1)}
+            for phalange in phalanges}
+
+
+def list_files_in_folders(service, folder_ids, folders_per_query=40):
+    # One (paged) files().list for a whole set of folders instead of one call per folder
+    files = []
+    for start in range(0, len(folder_ids), folders_per_query):
+        parents = ' or '.join(f"'{folder_id}' in parents" for folder_id in folder_ids[start:start + folders_per_query])
+        page_token = None
+        while True:
+            response = service.files().list(
+                q=f"({parents}) and trashed=false",
+                fields='nextPageToken, files(id, parents)',
+                pageSize=1000, pageToken=page_token).execute()
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+    return files
+
+
+def read_folder_cache(layer_count, cache_path=FOLDER_CACHE_PATH):
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        cache = json.load(f)
+    if cache.get('layers') != layer_count:
+        return None
+    return cache['folders']
+
+
+def write_folder_cache(folder_map, layer_count, cache_path=FOLDER_CACHE_PATH):
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'layers': layer_count, 'folders': folder_map}, f)
+    os.replace(temp_path, cache_path)
+
+
+def refresh_folder_cache(folder_map, layer_count, cache_path=FOLDER_CACHE_PATH, log=print):
+    # Rebuilds the map from Drive and patches the shared dict in place if anything moved
+    try:
+        current = build_folder_map(get_drive_service(), layer_count, log)
+    except Exception as e:
+        log(f"Could not validate the Drive folder cache: {e}")
+        return
+    if current != folder_map:
+        for phalange, layers in current.items():
+            folder_map[phalange] = layers
+        write_folder_cache(current, layer_count, cache_path)
+        log("Drive folder cache updated")
+
+
+def phalange_folders(layer_count, cache_path=FOLDER_CACHE_PATH, log=print):
+    # phalange -> layer -> folder id. Served from the local cache (checked against Drive in
+    # the background) and only built with network calls when the cache is missing or stale.
+    global _folder_map
+    with _folder_lock:
+        if _folder_map is None:
+            folder_map = read_folder_cache(layer_count, cache_path)
+            if folder_map is None:
+                folder_map = build_folder_map(get_drive_service(), layer_count, log)
+                write_folder_cache(folder_map, layer_count, cache_path)
+            else:
+                threading.Thread(target=refresh_folder_cache, args=(folder_map, layer_count, cache_path, log),
+                                 daemon=True).start()
+            _folder_map = folder_map
+    return _folder_map
+
+
+def delete_files(service, file_ids):
+    # Batch deletes, up to BATCH_LIMIT per round trip; files that are already gone are fine
+    failures = []
+
+    def on_deleted(request_id, response, exception):
+        if exception is not None and getattr(getattr(exception, 'resp', None), 'status', None) != 404:
+            failures.append(exception)
+
+    for start in range(0, len(file_ids), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=on_deleted)
+        for file_id in file_ids[start:start + BATCH_LIMIT]:
+            batch.add(service.files().delete(fileId=file_id))
+        batch.execute()
+    if failures:
+        raise failures[0]
+
+
+def clear_folders(folder_ids, service=None, log=print):
+    drive_service = service or get_drive_service()
+    files = list_files_in_folders(drive_service, list(folder_ids))
+    delete_files(drive_service, [file['id'] for file in files])
+    log(f"Deleted {len(files)} files from {len(folder_ids)} Google Drive folders")
+    return files
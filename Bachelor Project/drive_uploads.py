@@ -0,0 +1,200 @@
+import json
+import os
+import time
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+
+from drive_storage import FOLDER_MIME_TYPE, delete_files
+from storage_backend import file_digest
+
+UPLOAD_CACHE_PATH = 'drive_uploads.json'
+BLOB_FOLDER = 'Drag-And-Drop blobs'
+# Resumable upload chunks must be a multiple of 256 KB
+CHUNK_SIZE = 32 * 256 * 1024
+# Drive drops resumable sessions after a week
+SESSION_LIFETIME = 7 * 24 * 3600
+# Master copies no slot holds any more that are kept for quick re-placement, most recently placed first
+UNREFERENCED_BLOBS = 16
+
+
+def http_status(error):
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+class UploadCache:
+    # content hash -> id of the master copy in the blob folder (and when it was last
+    # placed), id of every placed copy -> content hash, file path -> stat and content hash
+    # (so unchanged files are not re-hashed) and content hash -> [resumable session URI,
+    # start time] of an upload that has not finished yet. path=None keeps it in memory only.
+    def __init__(self, path=UPLOAD_CACHE_PATH):
+        self.path = path
+        self.data = {'blob_folder': None, 'blobs': {}, 'blob_used': {}, 'placed': {}, 'hashes': {}, 'sessions': {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.data.update(json.load(f))
+        # Older caches keyed hashes by path:size:mtime and kept bare session URIs
+        self.data['hashes'] = {key: value for key, value in self.data['hashes'].items() if isinstance(value, list)}
+        self.data['sessions'] = {digest: session for digest, session in self.data['sessions'].items()
+                                 if isinstance(session, list) and time.time() - session[1] < SESSION_LIFETIME}
+
+    @property
+    def blobs(self):
+        return self.data['blobs']
+
+    @property
+    def placed(self):
+        return self.data['placed']
+
+    def digest(self, file_path):
+        # One entry per path, replaced when the file changes
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        version = f'{stat.st_size}:{stat.st_mtime_ns}'
+        entry = self.data['hashes'].get(path)
+        if entry is None or entry[0] != version:
+            entry = self.data['hashes'][path] = [version, file_digest(file_path)]
+            self.save()
+        return entry[1]
+
+    def session(self, digest):
+        session = self.data['sessions'].get(digest)
+        if session is None or time.time() - session[1] >= SESSION_LIFETIME:
+            return None
+        return session[0]
+
+    def set_session(self, digest, uri):
+        if uri is None:
+            self.data['sessions'].pop(digest, None)
+        else:
+            self.data['sessions'][digest] = [uri, time.time()]
+        self.save()
+
+    def add_placed(self, file_id, digest):
+        self.placed[file_id] = digest
+        self.data['blob_used'][digest] = time.time()
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(temp_path, self.path)
+
+
+def blob_folder_id(service, cache):
+    if cache.data['blob_folder']:
+        return cache.data['blob_folder']
+    query = f"name='{BLOB_FOLDER}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+    items = service.files().list(q=query, fields="files(id)").execute().get('files', [])
+    if items:
+        folder_id = items[0]['id']
+    else:
+        folder_id = service.files().create(body={'name': BLOB_FOLDER, 'mimeType': FOLDER_MIME_TYPE},
+                                           fields='id').execute()['id']
+    cache.data['blob_folder'] = folder_id
+    cache.save()
+    return folder_id
+
+
+def session_status(http, session_uri, size):
+    # Asks a resumable session how far it got with an empty PUT and 'Content-Range:
+    # bytes */size'. Returns (bytes the server has, None), (size, file resource) when the
+    # upload had already finished, or (None, None) when the session is gone.
+    response, content = http.request(session_uri, method='PUT', body=b'',
+                                     headers={'Content-Length': '0', 'Content-Range': f'bytes */{size}'})
+    status = int(response.status)
+    if status in (200, 201):
+        return size, json.loads(content)
+    if status == 308:
+        # 'Range: bytes=0-N' once the server has anything
+        received = response.get('range')
+        return (int(received.rsplit('-', 1)[1]) + 1 if received else 0), None
+    if status in (404, 410):
+        return None, None
+    raise HttpError(response, content, uri=session_uri)
+
+
+def upload_resumable(service, file_path, folder_id, cache, digest):
+    media = MediaFileUpload(file_path, chunksize=CHUNK_SIZE, resumable=True)
+    request = service.files().create(body={'name': os.path.basename(file_path), 'parents': [folder_id]},
+                                     media_body=media, fields='id')
+    session = cache.session(digest)
+    if session:
+        received, finished = session_status(request.http, session, media.size())
+        if finished is not None:
+            cache.set_session(digest, None)
+            return finished['id']
+        if received is None:
+            # The session expired; start over with a fresh one
+            cache.set_session(digest, None)
+            session = None
+        else:
+            request.resumable_uri = session
+            request.resumable_progress = received
+
+    response = None
+    while response is None:
+        try:
+            status, response = request.next_chunk(num_retries=3)
+        except Exception as e:
+            if session and http_status(e) in (404, 410):
+                cache.set_session(digest, None)
+                return upload_resumable(service, file_path, folder_id, cache, digest)
+            raise
+        if request.resumable_uri and cache.session(digest) != request.resumable_uri:
+            cache.set_session(digest, request.resumable_uri)
+
+    cache.set_session(digest, None)
+    return response['id']
+
+
+def place_file(file_path, folder_id, service, cache, log=print):
+    # Drive files can only have one parent, so placements are server-side copies of a
+    # master copy in the blob folder; bytes are only uploaded for content Drive has not seen.
+    digest = cache.digest(file_path)
+    body = {'name': os.path.basename(file_path), 'parents': [folder_id]}
+    blob_id = cache.blobs.get(digest)
+    if blob_id:
+        try:
+            file = service.files().copy(fileId=blob_id, body=body, fields='id').execute()
+            cache.add_placed(file['id'], digest)
+            log(f"File {file_path} copied to Google Drive folder {folder_id}")
+            return file['id']
+        except Exception as e:
+            if http_status(e) != 404:
+                raise
+            del cache.blobs[digest]
+
+    try:
+        blob_id = upload_resumable(service, file_path, blob_folder_id(service, cache), cache, digest)
+    except Exception as e:
+        if http_status(e) == 404:
+            cache.data['blob_folder'] = None
+        raise
+    cache.blobs[digest] = blob_id
+    cache.save()
+    file = service.files().copy(fileId=blob_id, body=body, fields='id').execute()
+    cache.add_placed(file['id'], digest)
+    log(f"File {file_path} uploaded to Google Drive folder {folder_id}")
+    return file['id']
+
+
+def collect_blobs(service, cache, deleted_ids, keep=UNREFERENCED_BLOBS, log=print):
+    # Forgets placed copies that were deleted, then deletes the master copies of content no
+    # placed copy refers to any more, apart from the `keep` most recently placed ones
+    for file_id in deleted_ids:
+        cache.placed.pop(file_id, None)
+    referenced = set(cache.placed.values())
+    unreferenced = sorted((digest for digest in cache.blobs if digest not in referenced),
+                          key=lambda digest: cache.data['blob_used'].get(digest, 0), reverse=True)
+    stale = unreferenced[keep:]
+    if stale:
+        delete_files(service, [cache.blobs[digest] for digest in stale])
+        for digest in stale:
+            del cache.blobs[digest]
+            cache.data['blob_used'].pop(digest, None)
+        log(f"Deleted {len(stale)} unused files from {BLOB_FOLDER}")
+    cache.save()
@@ -0,0 +1,121 @@
+import queue
+import random
+import socket
+import threading
+import time
+
+from metrics import NullCounter
+
+try:
+    from httplib2 import HttpLib2Error
+except ImportError:
+    HttpLib2Error = None
+
+
+# Failures of the connection itself, worth retrying; anything else without an HTTP status
+# (a KeyError in an operation, say) is a bug and fails at once instead of stalling the queue
+TRANSPORT_ERRORS = (ConnectionError, TimeoutError, socket.timeout, socket.gaierror) + (
+    (HttpLib2Error,) if HttpLib2Error is not None else ())
+
+
+def is_retryable(error):
+    # Drive signals throttling with 429 or a 403 rate-limit reason
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is None:
+        return isinstance(error, TRANSPORT_ERRORS)
+    status = int(status)
+    return status == 429 or status >= 500 or (status == 403 and 'rateLimitExceeded' in str(error))
+
+
+class StorageOperation:
+    def __init__(self, description, run, on_done=None):
+        self.description = description
+        self.run = run
+        self.on_done = on_done
+        self.status = 'pending'
+        self.attempts = 0
+        self.result = None
+        self.error = None
+
+
+class StorageWorker:
+    # Runs Drive calls on one background thread in submission order. run(service) is
+    # retried with exponential backoff; finished operations wait in a queue until the
+    # UI loop calls poll(), so on_done callbacks always run on the UI thread. Messages go
+    # to `log` (Main.py passes its EventLog) and failed operations count on `failures`.
+    def __init__(self, service_factory, max_retries=5, base_delay=0.5, max_delay=30, log=print, failures=None):
+        self.service_factory = service_factory
+        self.log = log
+        self.failures = failures or NullCounter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.pending = 0
+        self.failed = []
+        # Written by the worker thread only: Drive operations attempted and retried
+        self.calls = 0
+        self.retries = 0
+        self._operations = queue.Queue()
+        self._finished = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='drive-worker', daemon=True)
+        self._thread.start()
+
+    def submit(self, description, run, on_done=None):
+        operation = StorageOperation(description, run, on_done)
+        self.pending += 1
+        self._operations.put(operation)
+        return operation
+
+    def _run(self):
+        service = None
+        while True:
+            operation = self._operations.get()
+            if operation is None:
+                return
+            delay = self.base_delay
+            while True:
+                try:
+                    if service is None:
+                        service = self.service_factory()
+                    self.calls += 1
+                    operation.result = operation.run(service)
+                    operation.status = 'done'
+                    break
+                except Exception as e:
+                    operation.attempts += 1
+                    operation.error = e
+                    if operation.attempts > self.max_retries or not is_retryable(e):
+                        operation.status = 'failed'
+                        break
+                    self.retries += 1
+                    time.sleep(random.uniform(0.5, 1.0) * delay)
+                    delay = min(2 * delay, self.max_delay)
+            self._finished.put(operation)
+
+    def poll(self):
+        finished = []
+        while True:
+            try:
+                operation = self._finished.get_nowait()
+            except queue.Empty:
+                return finished
+            self.pending -= 1
+            if operation.status == 'failed':
+                self.failed.append(operation)
+                self.failures.inc()
+                self.log(f"Drive operation failed after {operation.attempts} attempts: {operation.description} ({operation.error})")
+            if operation.on_done is not None:
+                operation.on_done(operation)
+            finished.append(operation)
+
+    def status_line(self):
+        if not self.pending and not self.failed:
+            return None
+        return f"Drive: {self.pending} pending, {len(self.failed)} failed"
+
+    def stop(self):
+        if self.pending:
+            self.log(f"Waiting for {self.pending} Drive operations to finish...")
+        self._operations.put(None)
+        self._thread.join()
+        self.poll()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import time
+
+import cv2
+import edcc
+import mediapipe as mp
+
+from features import bounding_box, landmarks_to_array
+from frame_scaling import FrameDownscaler
+from palm_auth import PalmprintEngine
+from palm_gallery import MIN_SHORTLIST_RECALL, PalmGallery, code_to_bytes, installed_edcc_version, palm_descriptor
+
+
+GALLERY_PATH = os.path.join('palmprint_data', 'gallery.bin')
+TEMPLATE_INTERVAL = 0.5
+
+parser = argparse.ArgumentParser(description='Enroll a user into the palmprint gallery')
+parser.add_argument('name')
+parser.add_argument('--templates', type=int, default=5)
+parser.add_argument('--box', nargs=2, action='append', metavar=('LABEL', 'FILE'),
+                    help='label and file of a box this user can place; repeat for more boxes')
+parser.add_argument('--camera', type=int, default=1)
+args = parser.parse_args()
+
+hands = mp.solutions.hands.Hands(static_image_mode=False, max_num_hands=1, min_detection_confidence=0.75)
+engine = PalmprintEngine(edcc.create_encoder(edcc.EncoderConfig(29, 5, 5, 10)))
+downscale = FrameDownscaler(640)
+
+os.makedirs(os.path.dirname(GALLERY_PATH), exist_ok=True)
+gallery = PalmGallery.load(GALLERY_PATH) if os.path.exists(GALLERY_PATH) else PalmGallery()
+if len(gallery) and gallery.edcc_version != installed_edcc_version():
+    gallery.reencode(engine.encode)
+
+cap = cv2.VideoCapture(args.camera)
+codes, descriptors, images = [], [], []
+last_capture_time = 0
+
+while len(codes) < args.templates:
+    ret, frame = cap.read()
+    if not ret:
+        continue
+
+    results = hands.process(downscale(frame))
+    if results.multi_hand_landmarks and time.time() - last_capture_time >= TEMPLATE_INTERVAL:
+        h, w, _ = frame.shape
+        palm_box = bounding_box(landmarks_to_array(results.multi_hand_landmarks[0]), w, h)
+        palm_image = frame[palm_box[1]:palm_box[3], palm_box[0]:palm_box[2]]
+
+        if palm_image.size > 0:
+            codes.append(code_to_bytes(engine.encode(palm_image)))
+            descriptors.append(palm_descriptor(palm_image))
+            images.append(cv2.imencode('.png', palm_image)[1].tobytes())
+            last_capture_time = time.time()
+
+    cv2.putText(frame, f'{args.name}: {len(codes)}/{args.templates} templates', (50, 50),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.3, (0, 255, 0), 3, cv2.LINE_AA)
+    cv2.imshow('Enroll', frame)
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        break
+
+cap.release()
+cv2.destroyAllWindows()
+engine.close()
+
+if codes:
+    gallery.add_user(args.name, codes, descriptors, images, args.box)
+    gallery.save(GALLERY_PATH)
+    print(f'Enrolled {len(codes)} templates for {args.name} ({len(gallery.users)} users in the gallery)')
+    if gallery.recall is not None:
+        mode = 'shortlist' if gallery.recall >= MIN_SHORTLIST_RECALL else 'full scan'
+        print(f'Shortlist recall {gallery.recall:.1%}, identification uses the {mode}')
@@ -0,0 +1,171 @@
+import itertools
+import re
+import threading
+import time
+
+
+class FakeHttpError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(f'HTTP {status} {message}'.strip())
+        self.resp = type('FakeResponse', (), {'status': status})()
+
+
+class FakeRequest:
+    def __init__(self, service, handler):
+        self.service = service
+        self.handler = handler
+
+    def execute(self):
+        self.service.round_trip()
+        return self.handler()
+
+    def next_chunk(self, num_retries=0):
+        # Uploads finish in a single chunk
+        self.resumable_uri = None
+        return None, self.execute()
+
+
+class FakeBatch:
+    # Like googleapiclient's BatchHttpRequest: one round trip, per-request callbacks
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id if request_id is not None else str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        self.service.round_trip()
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = request.handler(), None
+            except FakeHttpError as e:
+                response, exception = None, e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class FakeFiles:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, **kwargs):
+        def handler():
+            with self.service.lock:
+                files = list(self.service.file_table.values())
+            matches = [dict(file) for file in files if self.service.matches(file, q)]
+            start = int(pageToken or 0)
+            response = {'files': matches[start:start + pageSize]}
+            if start + pageSize < len(matches):
+                response['nextPageToken'] = str(start + pageSize)
+            return response
+        return FakeRequest(self.service, handler)
+
+    def get(self, fileId, fields=None, **kwargs):
+        return FakeRequest(self.service, lambda: dict(self.service.get_file(fileId)))
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        def handler():
+            body_ = dict(body or {})
+            return self.service.add_file(body_.get('name', 'Untitled'), body_.get('parents', []),
+                                         body_.get('mimeType', 'application/octet-stream'))
+        return FakeRequest(self.service, handler)
+
+    def copy(self, fileId, body=None, fields=None, **kwargs):
+        def handler():
+            source = self.service.get_file(fileId)
+            body_ = dict(body or {})
+            return self.service.add_file(body_.get('name', source['name']), body_.get('parents', source['parents']),
+                                         source['mimeType'])
+        return FakeRequest(self.service, handler)
+
+    def delete(self, fileId, **kwargs):
+        def handler():
+            self.service.get_file(fileId)
+            with self.service.lock:
+                del self.service.file_table[fileId]
+            return ''
+        return FakeRequest(self.service, handler)
+
+
+class FakeDriveService:
+    # In-process stand-in for the Drive v3 client with just the files() calls and query
+    # syntax this project uses. Counts round trips, can add latency per round trip and
+    # can fail the next N round trips with a given HTTP status.
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.file_table = {}
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._failures = []
+
+    def fail_next(self, count=1, status=503):
+        self._failures.extend([status] * count)
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+            status = self._failures.pop(0) if self._failures else None
+        if self.latency:
+            time.sleep(self.latency)
+        if status is not None:
+            raise FakeHttpError(status)
+
+    def add_file(self, name, parents=(), mime_type='application/octet-stream'):
+        with self.lock:
+            file_id = f'fake{next(self._ids)}'
+            self.file_table[file_id] = {'id': file_id, 'name': name, 'parents': list(parents), 'mimeType': mime_type}
+        return {'id': file_id, 'name': name, 'parents': list(parents)}
+
+    def get_file(self, file_id):
+        file = self.file_table.get(file_id)
+        if file is None:
+            raise FakeHttpError(404, f'File not found: {file_id}')
+        return file
+
+    def files(self):
+        return FakeFiles(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def matches(self, file, query):
+        return all(self._clause_matches(file, clause) for clause in _split_top_level(query, ' and '))
+
+    def _clause_matches(self, file, clause):
+        clause = clause.strip()
+        if not clause:
+            return True
+        if clause.startswith('(') and clause.endswith(')'):
+            return any(self._clause_matches(file, part) for part in _split_top_level(clause[1:-1], ' or '))
+        match = re.fullmatch(r"'([^']*)' in parents", clause)
+        if match:
+            return match.group(1) in file['parents']
+        match = re.fullmatch(r"(name|mimeType)\s*(!?=)\s*'([^']*)'", clause)
+        if match:
+            key, operator, value = match.groups()
+            return (file[key] == value) == (operator == '=')
+        if clause == 'trashed=false':
+            return True
+        raise ValueError(f'Unsupported query clause: {clause}')
+
+
+def _split_top_level(query, separator):
+    parts, depth, start = [], 0, 0
+    i = 0
+    while i < len(query):
+        if query[i] == '(':
+            depth += 1
+        elif query[i] == ')':
+            depth -= 1
+        elif depth == 0 and query.startswith(separator, i):
+            parts.append(query[start:i])
+            i += len(separator)
+            start = i
+            continue
+        i += 1
+    parts.append(query[start:])
+    return parts
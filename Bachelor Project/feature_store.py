@@ -0,0 +1,99 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+from features import FEATURE_SIZE
+
+
+class FeatureStore:
+    # Append-only chunks of feature rows plus a manifest that maps every source key
+    # (an image path, for example) to its chunk/row. Re-adding a key just points the
+    # manifest at the new row; rows nobody points to are ignored by load().
+    def __init__(self, root='./features', chunk_size=500):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self.manifest = {'chunks': [], 'entries': {}}
+        self._pending = []
+
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    @property
+    def entries(self):
+        return self.manifest['entries']
+
+    def is_current(self, key, mtime):
+        entry = self.entries.get(key)
+        return entry is not None and entry.get('mtime') == mtime
+
+    def add(self, key, features, label, mtime=None):
+        # features=None records that the source had no usable hand, so it is not retried
+        self._pending.append((key, features, label, mtime))
+        if sum(features is not None for _, features, _, _ in self._pending) >= self.chunk_size:
+            self.flush()
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def flush(self):
+        rows = [(features, label) for _, features, label, _ in self._pending if features is not None]
+        chunk = None
+        if rows:
+            chunk = 'chunk_{:05d}.npz'.format(len(self.manifest['chunks']))
+            np.savez(os.path.join(self.root, chunk),
+                     data=np.asarray([features for features, _ in rows], dtype=np.float32),
+                     labels=np.asarray([label for _, label in rows]))
+            self.manifest['chunks'].append(chunk)
+
+        row = 0
+        for key, features, label, mtime in self._pending:
+            entry = {'label': label}
+            if mtime is not None:
+                entry['mtime'] = mtime
+            if features is not None:
+                entry['chunk'] = chunk
+                entry['row'] = row
+                row += 1
+            self.entries[key] = entry
+        self._pending = []
+
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def load(self, with_keys=False):
+        # with_keys=True also returns the key of every row, in the same order
+        rows_by_chunk = {}
+        keys_by_chunk = {}
+        for key in sorted(self.entries):
+            entry = self.entries[key]
+            if entry.get('chunk') is not None:
+                rows_by_chunk.setdefault(entry['chunk'], []).append(entry['row'])
+                keys_by_chunk.setdefault(entry['chunk'], []).append(key)
+
+        data, labels = [], []
+        for chunk, rows in rows_by_chunk.items():
+            with np.load(os.path.join(self.root, chunk), allow_pickle=False) as arrays:
+                data.append(arrays['data'][rows])
+                labels.append(arrays['labels'][rows])
+
+        if not data:
+            data, labels = np.empty((0, FEATURE_SIZE), dtype=np.float32), np.empty(0, dtype=str)
+        else:
+            data, labels = np.concatenate(data), np.concatenate(labels)
+        if with_keys:
+            return data, labels, [key for keys in keys_by_chunk.values() for key in keys]
+        return data, labels
+
+
+def write_dataset(store, path='data.pickle'):
+    # The data.pickle train_classifier.py reads, with the store key of every row
+    data, labels, keys = store.load(with_keys=True)
+    with open(path, 'wb') as f:
+        pickle.dump({'data': data, 'labels': labels, 'keys': keys}, f)
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+NUM_LANDMARKS = 21
+FEATURE_SIZE = 2 * NUM_LANDMARKS
+
+WRIST = 0
+INDEX_FINGER_TIP = 8
+
+# mp_hands.HandLandmark indices of the tip, PIP (IP for the thumb) and MCP joints of each finger
+FINGER_LANDMARKS = {
+    'Thumb': (4, 3, 2),
+    'Index Finger': (8, 6, 5),
+    'Middle Finger': (12, 10, 9),
+    'Ring Finger': (16, 14, 13),
+    'Pinky': (20, 18, 17),
+}
+FINGER_PRIORITY = ['Index Finger', 'Middle Finger', 'Ring Finger', 'Pinky']
+
+
+def landmarks_to_array(hand_landmarks):
+    return np.array([(landmark.x, landmark.y, landmark.z) for landmark in hand_landmarks.landmark],
+                    dtype=np.float32)
+
+
+def normalized_features(points):
+    xy = points[:, :2]
+    return (xy - xy.min(axis=0)).ravel()
+
+
+def bounding_box(points, width, height):
+    x_min, y_min = points[:, :2].min(axis=0)
+    x_max, y_max = points[:, :2].max(axis=0)
+    return [int(x_min * width), int(y_min * height), int(x_max * width), int(y_max * height)]
+
+
+def centroid(points):
+    return points[:, :2].mean(axis=0)
@@ -0,0 +1,98 @@
+import pickle
+
+import numpy as np
+
+
+class CompiledForest:
+    # All trees of a fitted RandomForestClassifier flattened into shared node arrays.
+    # Leaves point to themselves, so every tree can be walked in lock-step for
+    # `depth` steps without checking which trees have already finished. Class
+    # probabilities are only stored for leaves, indexed through `leaf_index`.
+    def __init__(self, feature, threshold, children, leaf_index, value, roots, classes, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.leaf_index = leaf_index
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.depth = int(depth)
+
+    def apply(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.shape[0] == 1:
+            return self._apply_one(X[0])[None, :]
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.repeat(self.roots[None, :], X.shape[0], axis=0)
+        for _ in range(self.depth):
+            go_right = X[rows, self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[nodes, go_right.view(np.uint8)]
+        return nodes
+
+    def _apply_one(self, x):
+        nodes = self.roots
+        for _ in range(self.depth):
+            go_right = x[self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[nodes, go_right.view(np.uint8)]
+        return nodes
+
+    def predict_proba(self, X):
+        return self.value[self.leaf_index[self.apply(X)]].mean(axis=1)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def save(self, path):
+        np.savez(path, feature=self.feature, threshold=self.threshold, children=self.children,
+                 leaf_index=self.leaf_index, value=self.value, roots=self.roots, classes=self.classes_, depth=self.depth)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays['feature'], arrays['threshold'], arrays['children'], arrays['leaf_index'],
+                       arrays['value'], arrays['roots'], arrays['classes'], arrays['depth'])
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+
+def compile_forest(model):
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+
+    features, thresholds, children, leaf_indices, values = [], [], [], [], []
+    leaf_count = 0
+    for offset, tree in zip(offsets, trees):
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+        left = np.where(is_leaf, nodes, tree.children_left) + offset
+        right = np.where(is_leaf, nodes, tree.children_right) + offset
+
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(tree.threshold)
+        children.append(np.stack([left, right], axis=1))
+        leaf_indices.append(np.where(is_leaf, np.cumsum(is_leaf) - 1 + leaf_count, -1))
+        leaf_count += int(is_leaf.sum())
+        value = tree.value[is_leaf, 0, :]
+        values.append(value / value.sum(axis=1, keepdims=True))
+
+    node_count = int(offsets[-1] + trees[-1].node_count)
+    index_type = np.int32 if node_count < 2 ** 31 else np.int64
+    return CompiledForest(
+        feature=np.concatenate(features).astype(np.int16),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        children=np.concatenate(children).astype(index_type),
+        leaf_index=np.concatenate(leaf_indices).astype(index_type),
+        value=np.concatenate(values).astype(np.float32),
+        roots=offsets.astype(index_type),
+        classes=np.asarray(model.classes_),
+        depth=max(tree.max_depth for tree in trees),
+    )
+
+
+def load_model(path):
+    if path.endswith('.npz'):
+        return CompiledForest.load(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)['model']
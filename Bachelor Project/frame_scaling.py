@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+
+
+class FrameDownscaler:
+    # MediaPipe landmarks are normalized to [0, 1], so keeping the camera's aspect ratio
+    # here means they map straight back onto the full-resolution frame with `* W` / `* H`.
+    # The returned buffer is reused between calls: use one instance per thread. With
+    # rgb=False it stays BGR and is always a copy, e.g. a display frame to draw on.
+    def __init__(self, max_width=640, rgb=True, interpolation=cv2.INTER_AREA):
+        self.max_width = max_width
+        self.rgb = rgb
+        self.interpolation = interpolation
+        self._resized = None
+        self._rgb = None
+
+    def inference_size(self, frame_shape):
+        height, width = frame_shape[:2]
+        if not self.max_width or width <= self.max_width:
+            return width, height
+        return self.max_width, max(1, round(height * self.max_width / width))
+
+    def __call__(self, frame):
+        width, height = self.inference_size(frame.shape)
+        if self._rgb is None or self._rgb.shape[:2] != (height, width):
+            self._resized = np.empty((height, width, 3), dtype=np.uint8)
+            self._rgb = np.empty((height, width, 3), dtype=np.uint8)
+
+        source = frame
+        if frame.shape[:2] != (height, width):
+            cv2.resize(frame, (width, height), dst=self._resized, interpolation=self.interpolation)
+            source = self._resized
+        if not self.rgb:
+            if source is frame:
+                np.copyto(self._resized, frame)
+            return self._resized
+        cv2.cvtColor(source, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        return self._rgb
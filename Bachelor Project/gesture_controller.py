@@ -0,0 +1,355 @@
+import random
+
+import numpy as np
+
+from features import centroid
+from metrics import NullCounter
+
+
+FINGER_GESTURES = ['top of index', 'middle of index', 'bottom of index',
+                   'top of middle', 'middle of middle', 'bottom of middle',
+                   'top of ring', 'middle of ring', 'bottom of ring',
+                   'top of pinky', 'middle of pinky', 'bottom of pinky']
+GESTURE_TO_FOLDER = {gesture: f'phalange {index + 1}' for index, gesture in enumerate(FINGER_GESTURES)}
+# One-hand gestures that are shown on the display and drive the cursor
+HAND_GESTURES = ['point', 'select 1', 'select 2', 'drop 1', 'drop 2']
+
+BOX_DWELL_TIME = 3
+GESTURE_HOLD_TIME = 0.5
+PLACE_HOLD_TIME = 1
+SWIPE_DISTANCE = 0.2
+SWIPE_TIME = 1.0
+SWITCH_RADIUS = 20
+CURSOR_STATIONARY_TIME = 2
+MOVEMENT_THRESHOLD = 20
+SWITCH_COOLDOWN = 5
+
+
+class GestureController:
+    # The drag and drop state machine of Main.py, free of MediaPipe and drawing so it can be
+    # driven from recorded or synthetic hands. Per rendered frame update() takes the hand
+    # landmarks, the one-hand prediction and the touch (None on the second camera) and
+    # returns the boxes for the cursor window; `cursor`, `shown_gesture` and `layer` are what
+    # the display draws. Dwell, hold, cooldown and swipe windows are measured with `clock`.
+    def __init__(self, storage, switch_storage, clock, labels, boxes, layer_count, layer=1, log=print,
+                 placements=None, clears=None, rng=random, window_size=(640, 480), box_size=50):
+        self.storage = storage
+        self.switch_storage = switch_storage
+        self.clock = clock
+        self.labels = labels
+        (self.box1_label, self.box1_file), (self.box2_label, self.box2_file) = boxes
+        self.layer_count = layer_count
+        self.layer = layer
+        self.log = log
+        self.placements = placements or NullCounter()
+        self.clears = clears or NullCounter()
+        self.window_size = window_size
+        self.box_size = box_size
+
+        self.box1_x, self.box1_y = rng.randint(0, 590), rng.randint(0, 430)
+        self.box2_x, self.box2_y = rng.randint(0, 590), rng.randint(0, 430)
+        self.box3_x, self.box3_y = rng.randint(0, 590), rng.randint(0, 430)
+        self.box1_visible = True
+        self.box2_visible = True
+        self.box3_visible = False
+        self.box1_activated = False
+        self.box2_activated = False
+        self.box3_activated = False
+        self.box1_start_time = None
+        self.box2_start_time = None
+        self.picked_box = None
+        self.box_picked = False
+
+        self.state = 0
+        self.gesture = None
+        self.last_gesture = None
+        self.last_gesture_time = clock()
+        self.gesture_start_times = {i: None for i in range(5, 17)}
+        self.cooldown_end_time = 0
+        self.drop_state = 0
+        self.drop_pending = False
+
+        self.cursor_x, self.cursor_y = None, None
+        self.draw_cursor = False
+        self.shown_gesture = None
+        self.two_hands_detected = False
+        self.box_points = []
+        self.center_point = None
+        self.last_cursor_position = None
+        self.stationary_start_time = None
+        self.cursor_leave_time = None
+        self.left_switch_area = False
+        self.switch_cooldown_end_time = 0
+
+        self.swipe_start_time = None
+        self.swipe_detected = False
+
+    @property
+    def cursor(self):
+        return (self.cursor_x, self.cursor_y) if self.draw_cursor else None
+
+    def update(self, hand_points, prediction, touch, width, height):
+        # width/height: size of the camera frame the normalized landmarks refer to
+        boxes = self.boxes()
+        self.draw_cursor = False
+        self.shown_gesture = None
+        hand_count = len(hand_points)
+
+        if hand_count == 2:
+            self.two_hands_detected = True
+
+        if hand_count == 1:
+            self.gesture = self.labels[int(prediction[0])]
+            if self.gesture == 'point':
+                self.track_cursor(hand_points[0], width, height)
+
+            if self.gesture in HAND_GESTURES:
+                self.shown_gesture = self.gesture
+                if self.cursor_x is not None and self.cursor_y is not None:
+                    self.draw_cursor = True
+                    self.dwell(self.clock())
+
+                current_time = self.clock()
+                if self.gesture != self.last_gesture:
+                    self.last_gesture = self.gesture
+                    self.last_gesture_time = current_time
+                if current_time - self.last_gesture_time >= GESTURE_HOLD_TIME:
+                    self.select()
+
+        if hand_count == 2 and touch:
+            self.handle_touch(touch, width, height)
+
+        if self.drop_pending:
+            self.handle_drop()
+
+        if self.two_hands_detected and self.cursor_x is not None and self.cursor_y is not None:
+            self.draw_cursor = True
+
+        if hand_count == 2:
+            self.handle_swipe(hand_points[0][0], hand_points[1][0])
+        return boxes
+
+    def boxes(self):
+        # (x, y, color, label or None) for CursorCompositor.render; an activated box also
+        # deactivates the boxes listed before it
+        boxes = []
+        if self.box1_visible:
+            if not self.box1_activated:
+                boxes.append((self.box1_x, self.box1_y, (255, 255, 255), self.box1_label))
+            if self.box1_activated:
+                boxes.append((self.box1_x, self.box1_y, (0, 0, 255), None))
+                self.box2_activated = False
+
+        if self.box2_visible:
+            if not self.box2_activated:
+                boxes.append((self.box2_x, self.box2_y, (255, 255, 255), self.box2_label))
+            if self.box2_activated:
+                boxes.append((self.box2_x, self.box2_y, (0, 0, 255), None))
+                self.box1_activated = False
+        if self.box3_visible:
+            if not self.box3_activated:
+                boxes.append((self.box3_x, self.box3_y, (255, 255, 255), 'New Box'))
+            if self.box3_activated:
+                boxes.append((self.box3_x, self.box3_y, (0, 0, 255), None))
+                self.box1_activated = False
+                self.box2_activated = False
+        return boxes
+
+    def track_cursor(self, points, width, height):
+        # Resting the cursor defines a center point; leaving it and resting there again switches storage
+        mean_x, mean_y = centroid(points)
+        self.cursor_x, self.cursor_y = int(mean_x * width), int(mean_y * height)
+        self.box_points.append((self.cursor_x, self.cursor_y))
+        if len(self.box_points) > 4:
+            self.box_points.pop(0)
+        if len(self.box_points) != 4 or np.linalg.norm(np.array(self.box_points[0]) - np.array(self.box_points[3])) >= 50:
+            return
+
+        current_cursor_position = (self.cursor_x, self.cursor_y)
+        current_time = self.clock()
+        if self.last_cursor_position is None or np.linalg.norm(
+                np.array(current_cursor_position) - np.array(self.last_cursor_position)) > MOVEMENT_THRESHOLD:
+            self.last_cursor_position = current_cursor_position
+            self.stationary_start_time = current_time
+
+        if current_time - self.stationary_start_time >= CURSOR_STATIONARY_TIME:
+            if self.center_point is None:
+                self.center_point = current_cursor_position
+                self.log(f"New center point defined at {self.center_point}")
+
+        if self.center_point is None:
+            return
+        distance_from_center = np.linalg.norm(np.array(current_cursor_position) - np.array(self.center_point))
+        if distance_from_center > SWITCH_RADIUS:
+            if self.cursor_leave_time is None:
+                self.cursor_leave_time = current_time
+                self.left_switch_area = True
+            return
+
+        self.cursor_leave_time = None
+        if self.left_switch_area and current_time - self.stationary_start_time >= CURSOR_STATIONARY_TIME:
+            if current_time >= self.switch_cooldown_end_time:
+                self.storage = self.switch_storage(self.storage)
+                self.switch_cooldown_end_time = current_time + SWITCH_COOLDOWN
+                self.box_points = []
+                self.center_point = None
+                self.cursor_leave_time = None
+                self.stationary_start_time = None
+                self.last_cursor_position = None
+                self.left_switch_area = False
+
+    def dwell(self, now):
+        # Keeping the cursor on a visible box activates it
+        size = self.box_size
+        if (self.box1_x <= self.cursor_x <= self.box1_x + size and self.box1_y <= self.cursor_y <= self.box1_y + size
+                and self.box1_visible):
+            if self.box1_start_time is None:
+                self.box1_start_time = now
+            elif now - self.box1_start_time >= BOX_DWELL_TIME:
+                self.box1_activated = True
+        else:
+            self.box1_start_time = None
+
+        if (self.box2_x <= self.cursor_x <= self.box2_x + size and self.box2_y <= self.cursor_y <= self.box2_y + size
+                and self.box2_visible):
+            if self.box2_start_time is None:
+                self.box2_start_time = now
+            elif now - self.box2_start_time >= BOX_DWELL_TIME:
+                self.box2_activated = True
+        else:
+            self.box2_start_time = None
+
+    def select(self):
+        # 'select 1' then 'select 2' picks up the activated box
+        if self.gesture == 'select 1' and self.state == 0:
+            self.state = 1
+        elif self.gesture == 'select 2' and self.state == 1 and not self.box_picked:
+            if self.box1_activated:
+                self.picked_box = 'box1'
+                self.box1_visible = False
+                self.box2_activated = False
+                self.box2_visible = True
+                self.box_picked = True
+                self.log('box1 picked up')
+            if self.box2_activated:
+                self.picked_box = 'box2'
+                self.box2_visible = False
+                self.box1_activated = False
+                self.box1_visible = True
+                self.box_picked = True
+                self.log('box2 picked up')
+
+            self.state = 0
+
+    def handle_touch(self, touch, width, height):
+        pointer_tip, fingertip = touch.pointer_point, touch.target_point
+        self.gesture = touch.target
+
+        current_time = self.clock()
+        if self.gesture != self.last_gesture:
+            self.last_gesture = self.gesture
+
+        if self.gesture not in self.labels.values():
+            return
+        self.cursor_x = int((pointer_tip[0] + fingertip[0]) / 2 * width)
+        self.cursor_y = int((pointer_tip[1] + fingertip[1]) / 2 * height)
+        self.draw_cursor = True
+        self.dwell(current_time)
+
+        if current_time - self.last_gesture_time < GESTURE_HOLD_TIME:
+            return
+        self.select()
+
+        if self.gesture in FINGER_GESTURES:
+            self.handle_finger(FINGER_GESTURES.index(self.gesture) + 5)
+        else:
+            for index in range(5, 17):
+                self.gesture_start_times[index] = None
+        self.last_gesture = self.gesture
+
+    def handle_finger(self, finger_index):
+        # Holding a phalange places the picked box there, or arms a drop if the slot has data
+        current_time = self.clock()
+        folder = GESTURE_TO_FOLDER[self.gesture]
+        if current_time < self.cooldown_end_time:
+            self.log("Cooldown active, ignoring gestures")
+        elif not self.storage.ready():
+            # Slots are unknown until the backend has synced; shown in the status line
+            self.log(f"{self.storage.name} storage is still syncing, ignoring gestures")
+        elif self.picked_box:
+            if self.gesture_start_times[finger_index] is None:
+                self.gesture_start_times[finger_index] = current_time
+
+            if current_time - self.gesture_start_times[finger_index] >= PLACE_HOLD_TIME:
+                place_path = self.box1_file if self.picked_box == 'box1' else self.box2_file
+                if self.storage.place(finger_index - 4, self.layer, place_path,
+                                      self.return_box(self.picked_box, folder, self.layer)):
+                    self.log(f'{self.picked_box} placed in {folder} in layer {self.layer}')
+                    self.placements.inc()
+                    self.picked_box = None
+                    self.box2_activated = False
+                    self.box1_activated = False
+                    self.box_picked = False
+                    self.cooldown_end_time = current_time + self.storage.placement_cooldown
+                else:
+                    self.log(f"{folder} in layer {self.layer} is full")
+                self.gesture_start_times[finger_index] = None
+        elif self.storage.peek(finger_index - 4, self.layer):
+            self.log("Data is ready to be dropped")
+            self.drop_pending = True
+        else:
+            self.log(f"{folder} in layer {self.layer} is empty")
+
+    def return_box(self, box, folder, layer):
+        # on_failed for a placement: the box has already left the hand, so a write that
+        # fails for good puts it back in the cursor window to be picked up again
+        def on_failed():
+            if box == 'box1':
+                self.box1_visible = True
+            else:
+                self.box2_visible = True
+            self.log(f'{box} could not be stored in {folder} in layer {layer}, returned it to the window')
+        return on_failed
+
+    def handle_drop(self):
+        # 'drop 1' then 'drop 2' clears the layer and spawns a new box in the middle of the window
+        if self.gesture == 'drop 1' and self.drop_state == 0:
+            self.drop_state = 1
+            self.log("Drop state 1 activated")
+        elif self.gesture == 'drop 2' and self.drop_state == 1:
+            self.drop_state = 2
+            self.log("Drop state 2 activated")
+
+        if self.drop_state != 2:
+            return
+        occupied = self.storage.list(self.layer)
+        if occupied:
+            for phalange, _ in occupied:
+                self.log(f'Removing files from phalange {phalange} in layer {self.layer}')
+            self.storage.clear(occupied)
+            self.clears.inc()
+
+            width, height = self.window_size
+            self.box3_x, self.box3_y = (width - self.box_size) // 2, (height - self.box_size) // 2
+            self.box3_visible = True
+            self.log(f'New box spawned at ({self.box3_x}, {self.box3_y})')
+        self.drop_state = 0
+        self.drop_pending = False
+
+    def handle_swipe(self, left_wrist, right_wrist):
+        # Wrists brought together and apart again within SWIPE_TIME change the layer
+        if self.swipe_start_time is None:
+            self.swipe_start_time = self.clock()
+
+        if abs(left_wrist[0] - right_wrist[0]) < SWIPE_DISTANCE and abs(left_wrist[1] - right_wrist[1]) < SWIPE_DISTANCE:
+            if not self.swipe_detected:
+                self.swipe_detected = True
+                self.swipe_start_time = self.clock()
+        else:
+            if self.swipe_detected and self.clock() - self.swipe_start_time < SWIPE_TIME:
+                self.layer += 1
+                if self.layer > self.layer_count:
+                    self.layer = 1
+                self.log(f"Layer changed to {self.layer}")
+            self.swipe_detected = False
+            self.swipe_start_time = None
@@ -0,0 +1,60 @@
+import time
+
+import mediapipe as mp
+
+from features import landmarks_to_array, normalized_features
+from frame_scaling import FrameDownscaler
+from prediction_cache import PredictionCache
+
+
+STAGES = ['downscale', 'hands', 'features', 'classify']
+
+
+def create_gesture_tracker():
+    return mp.solutions.hands.Hands(static_image_mode=False, min_detection_confidence=0.3, min_tracking_confidence=0.5)
+
+
+class FrameProcessor:
+    # Per-camera inference for GesturePipeline: its own tracker, downscaler and prediction
+    # cache, so one instance per camera, called on that camera's inference thread.
+    # Returns (results, hand_points, prediction), or None without hands. With
+    # stage_times (stage -> list) the duration of every stage is appended to it.
+    def __init__(self, model, inference_width=640, classify_epsilon=0.01, classify_max_age=0.5, stage_times=None):
+        self.hands = create_gesture_tracker()
+        self.downscale = FrameDownscaler(inference_width)
+        self.classify = PredictionCache(model.predict, classify_epsilon, classify_max_age)
+        self.stage_times = stage_times
+
+    def __call__(self, frame, frame_time):
+        timer = StageTimer(self.stage_times)
+        image = self.downscale(frame)
+        timer.lap('downscale')
+        results = self.hands.process(image)
+        timer.lap('hands')
+
+        if not results.multi_hand_landmarks:
+            self.classify.reset()
+            return None
+
+        hand_points = [landmarks_to_array(hand_landmarks) for hand_landmarks in results.multi_hand_landmarks]
+        timer.lap('features')
+        prediction = None
+        if len(hand_points) == 1:
+            prediction = self.classify(normalized_features(hand_points[0]), frame_time)
+        else:
+            self.classify.reset()
+        timer.lap('classify')
+        return results, hand_points, prediction
+
+
+class StageTimer:
+    def __init__(self, stage_times):
+        self.stage_times = stage_times
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        if self.stage_times is None:
+            return
+        now = time.perf_counter()
+        self.stage_times.setdefault(stage, []).append(now - self.last)
+        self.last = now
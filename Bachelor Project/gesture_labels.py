@@ -0,0 +1,67 @@
+import json
+import os
+
+
+LABELS_FILE = 'labels.json'
+
+# The gestures the original model was trained on. Only used to migrate a model from before
+# labels.json existed: the first load writes them to its labels.json, which is the only
+# source of names from then on.
+DEFAULT_LABELS = {
+    0: 'point',
+    1: 'select 1',
+    2: 'select 2',
+    3: 'drop 1',
+    4: 'drop 2',
+    5: 'top of index',
+    6: 'middle of index',
+    7: 'bottom of index',
+    8: 'top of middle',
+    9: 'middle of middle',
+    10: 'bottom of middle',
+    11: 'top of ring',
+    12: 'middle of ring',
+    13: 'bottom of ring',
+    14: 'top of pinky',
+    15: 'middle of pinky',
+    16: 'bottom of pinky'
+}
+
+
+def labels_path(model_path):
+    return os.path.join(os.path.dirname(model_path) or '.', LABELS_FILE)
+
+
+def load_labels(model_path):
+    # class id (the feature store label as an int) -> gesture name, from the labels.json
+    # next to the model
+    path = labels_path(model_path)
+    if not os.path.exists(path):
+        return migrate_labels(model_path)
+    with open(path) as f:
+        return {int(class_id): name for class_id, name in json.load(f).items()}
+
+
+def migrate_labels(model_path):
+    # A model without labels.json is the original 17 gesture one
+    try:
+        write_labels(labels_path(model_path), DEFAULT_LABELS)
+    except OSError:
+        pass
+    return dict(DEFAULT_LABELS)
+
+
+def save_labels(model_path, classes, names=None):
+    # Names come from `names`, then the current labels.json, then the class id itself
+    known = load_labels(model_path)
+    known.update(names or {})
+    labels = {int(class_id): known.get(int(class_id), f'gesture {class_id}') for class_id in classes}
+    write_labels(labels_path(model_path), labels)
+    return labels
+
+
+def write_labels(path, labels):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({str(class_id): name for class_id, name in sorted(labels.items())}, f, indent=2)
+    os.replace(temp_path, path)
@@ -0,0 +1,281 @@
+import bisect
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bucket bounds in milliseconds, roughly log-spaced around the 33 ms frame budget;
+# anything slower lands in the overflow bucket
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 16, 25, 33, 50, 75, 100, 250, 500, 1000, 2500)
+SNAPSHOT_INTERVAL = 5.0
+EVENT_INTERVAL = 1.0
+
+
+class Histogram:
+    # Fixed-bucket latency histogram: recording is a bisect and three additions, with no
+    # allocation, so it can sit on every frame. append(seconds) lets it stand in for the
+    # sample lists of gesture_inference.StageTimer. Each histogram should be written from
+    # one thread; snapshots read it without locking and may be one sample behind.
+    def __init__(self, name, bounds=LATENCY_BUCKETS_MS):
+        self.name = name
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def append(self, seconds):
+        self.observe(1000 * seconds)
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th percentile (the max for the overflow bucket)
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'mean_ms': self.total / self.count if self.count else None,
+                'max_ms': self.max, 'p50_ms': self.percentile(50), 'p95_ms': self.percentile(95),
+                'p99_ms': self.percentile(99), 'bounds_ms': list(self.bounds), 'counts': list(self.counts)}
+
+
+class NullHistogram:
+    # What a disabled Metrics hands out, so instrumented code needs no checks of its own
+    count = 0
+
+    def observe(self, ms):
+        pass
+
+    def append(self, seconds):
+        pass
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class NullCounter:
+    value = 0
+
+    def inc(self, amount=1):
+        pass
+
+
+class Timer:
+    # with metrics.timer('stage'): ... records the block's duration on the monotonic clock
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.append(time.perf_counter() - self.start)
+
+
+class Metrics:
+    # Registry of histograms, counters and gauges. Gauges are functions evaluated only when
+    # a snapshot is taken, which is how numbers other objects already keep (queue drops,
+    # cache hits, Drive calls) are exported without touching their hot paths. With
+    # enabled=False every histogram and counter is a no-op.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, bounds=LATENCY_BUCKETS_MS):
+        if not self.enabled:
+            return NullHistogram()
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, bounds)
+            return self.histograms[name]
+
+    def counter(self, name):
+        if not self.enabled:
+            return NullCounter()
+        with self._lock:
+            if name not in self.counters:
+                self.counters[name] = Counter(name)
+            return self.counters[name]
+
+    def gauge(self, name, read):
+        if self.enabled:
+            with self._lock:
+                self.gauges[name] = read
+
+    def timer(self, name):
+        return Timer(self.histogram(name))
+
+    def stage_times(self, prefix, stages):
+        # For FrameProcessor(stage_times=...): a histogram per stage instead of sample lists
+        if not self.enabled:
+            return None
+        return {stage: self.histogram(f'{prefix}{stage}') for stage in stages}
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        values = {}
+        for name, read in gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                values[name] = f'error: {e}'
+        return {
+            'timestamp': time.time(),
+            'uptime_s': time.time() - self.started,
+            'counters': {name: counter.value for name, counter in counters.items()},
+            'gauges': values,
+            'histograms': {name: histogram.snapshot() for name, histogram in histograms.items()},
+        }
+
+
+class EventLog:
+    # print() replacement for the frame loop. log() only takes a lock and enqueues; a
+    # background thread does the writing. A key logged again within `interval` seconds is
+    # counted and dropped, and the count is appended to the next message with that key,
+    # so a message raised on every frame shows up once a second instead of 30 times.
+    def __init__(self, interval=EVENT_INTERVAL, stream=None, maxsize=1000):
+        self.interval = interval
+        self.stream = stream
+        self.logged = 0
+        self.suppressed = 0
+        self.dropped = 0
+        self._last = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+
+    def log(self, message, key=None):
+        key = message if key is None else key
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._pending[key] = self._pending.get(key, 0) + 1
+                self.suppressed += 1
+                return False
+            self._last[key] = now
+            self.logged += 1
+            repeats = self._pending.pop(key, 0)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+                self._thread.start()
+        if repeats:
+            message = f'{message} (+{repeats} suppressed)'
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is not None:
+                print(message, file=self.stream or sys.stdout, flush=True)
+            self._queue.task_done()
+
+    def flush(self):
+        # Waits until everything logged so far has been written
+        if self._thread is not None:
+            self._queue.join()
+
+
+class MetricsExporter:
+    # Publishes Metrics snapshots from a background thread: rewritten as JSON to `path`
+    # every `interval` seconds and/or served as GET /metrics on 127.0.0.1:`port`, where
+    # the snapshot is taken per request.
+    def __init__(self, metrics, path=None, port=None, interval=SNAPSHOT_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.path:
+            self._threads.append(threading.Thread(target=self._write_loop, name='metrics-file', daemon=True))
+        if self.port is not None:
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.port), self._handler())
+            self.server.daemon_threads = True
+            self._threads.append(threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def write(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+        if self.path:
+            self.write()
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+
+
+class CursorCompositor:
+    # The cursor window is a cached static layer (boxes and their labels, only redrawn
+    # when one of them changes) plus the cursor. Per frame only the area the cursor
+    # covered last time is restored from the static layer before the cursor is drawn
+    # again. render() returns the same preallocated buffer every call.
+    def __init__(self, width=640, height=480, box_size=50, cursor_radius=10):
+        self.box_size = box_size
+        self.cursor_radius = cursor_radius
+        self.static = np.zeros((height, width, 3), dtype=np.uint8)
+        self.output = np.zeros_like(self.static)
+        self.static_redraws = 0
+        self._boxes = None
+        self._dirty = None
+
+    @property
+    def shape(self):
+        return self.output.shape
+
+    def render(self, boxes, cursor=None):
+        # boxes: [(x, y, color, label or None)]; cursor: (x, y) or None
+        boxes = tuple(boxes)
+        if boxes != self._boxes:
+            self._draw_static(boxes)
+            np.copyto(self.output, self.static)
+        elif self._dirty is not None:
+            x1, y1, x2, y2 = self._dirty
+            self.output[y1:y2, x1:x2] = self.static[y1:y2, x1:x2]
+        self._dirty = None
+
+        if cursor is not None:
+            x, y = cursor
+            cv2.circle(self.output, (x, y), self.cursor_radius, (0, 0, 255), -1)
+            height, width = self.output.shape[:2]
+            reach = self.cursor_radius + 1
+            self._dirty = (min(max(x - reach, 0), width), min(max(y - reach, 0), height),
+                           min(max(x + reach + 1, 0), width), min(max(y + reach + 1, 0), height))
+        return self.output
+
+    def _draw_static(self, boxes):
+        self.static[:] = 0
+        for x, y, color, label in boxes:
+            cv2.rectangle(self.static, (x, y), (x + self.box_size, y + self.box_size), color, -1)
+            if label:
+                cv2.putText(self.static, label, (x, y + self.box_size + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                            (255, 255, 255), 2)
+        self._boxes = boxes
+        self.static_redraws += 1
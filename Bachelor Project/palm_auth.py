@@ -0,0 +1,168 @@
+import math
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+# tmpfs on Linux, so the fallback scratch file never touches the disk there
+SCRATCH_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class PalmprintEngine:
+    # Keeps the enrolled templates' EDCC codes in memory and encodes captured crops
+    # from buffers. Encoders without encode_using_bytes go through one reused scratch file.
+    def __init__(self, encoder, image_format='.bmp'):
+        self.encoder = encoder
+        self.image_format = image_format
+        self.template_codes = []
+        self._scratch_path = None
+
+    def encode(self, image):
+        ok, buffer = cv2.imencode(self.image_format, image)
+        if not ok:
+            raise ValueError('Could not encode palm image')
+        if hasattr(self.encoder, 'encode_using_bytes'):
+            return self.encoder.encode_using_bytes(buffer.tobytes())
+
+        if self._scratch_path is None:
+            fd, self._scratch_path = tempfile.mkstemp(prefix='palm_', suffix=self.image_format, dir=SCRATCH_DIR)
+            os.close(fd)
+        with open(self._scratch_path, 'wb') as f:
+            f.write(buffer.tobytes())
+        return self.encoder.encode_using_file(self._scratch_path)
+
+    def enroll(self, image):
+        self.template_codes = [self.encode(image)]
+
+    def score(self, image):
+        code = self.encode(image)
+        return max(code.compare_to(template_code) for template_code in self.template_codes)
+
+    def close(self):
+        if self._scratch_path is not None:
+            os.remove(self._scratch_path)
+            self._scratch_path = None
+
+
+class ParallelPalmScorer:
+    # Scores palm crops on a thread pool, one PalmprintEngine (and encoder from
+    # make_encoder) per worker. EDCC runs in C through ctypes, which releases the GIL.
+    # Scores are handed back strictly in submission order, so whatever consumes them
+    # sees the same sequence for any number of workers.
+    def __init__(self, make_encoder, template_codes, workers=None):
+        self.make_encoder = make_encoder
+        self.template_codes = template_codes
+        self.workers = workers or os.cpu_count() or 1
+        self._local = threading.local()
+        self._engines = []
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='palm-encoder')
+
+    def _score(self, image):
+        engine = getattr(self._local, 'engine', None)
+        if engine is None:
+            engine = PalmprintEngine(self.make_encoder())
+            engine.template_codes = self.template_codes
+            self._local.engine = engine
+            self._engines.append(engine)
+        return engine.score(image)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def submit(self, image):
+        # image=None keeps the attempt's place in the sequence and scores as None
+        self._pending.append(None if image is None else self._executor.submit(self._score, image))
+
+    def completed(self, max_in_flight=None):
+        # Yields finished scores in order; blocks while more than max_in_flight are pending
+        while self._pending:
+            future = self._pending[0]
+            must_wait = max_in_flight is not None and len(self._pending) > max_in_flight
+            if future is not None and not future.done() and not must_wait:
+                return
+            self._pending.popleft()
+            yield None if future is None else future.result()
+
+    def close(self):
+        for future in self._pending:
+            if future is not None:
+                future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+        for engine in self._engines:
+            engine.close()
+
+
+class AuthDecision:
+    def __init__(self, accepted, frames_used, passes, user=None):
+        self.accepted = accepted
+        self.frames_used = frames_used
+        self.passes = passes
+        self.user = user
+
+    def __bool__(self):
+        return self.accepted
+
+    def __repr__(self):
+        return 'AuthDecision(accepted={}, frames_used={}, passes={}, user={})'.format(
+            self.accepted, self.frames_used, self.passes, self.user and self.user['name'])
+
+
+class SequentialVerifier:
+    # 'exact' stops as soon as `required_passes` out of `total_attempts` is reached or
+    # can no longer be reached, so it always agrees with scoring all attempts.
+    # 'confidence' also stops once the Wilson interval of the pass rate (z = confidence_z)
+    # lies entirely above or below required_passes / total_attempts.
+    def __init__(self, total_attempts=100, required_passes=85, score_threshold=0.01,
+                 stopping='exact', confidence_z=2.58, min_frames=10):
+        if stopping not in ('exact', 'confidence'):
+            raise ValueError(f'Unknown stopping rule: {stopping}')
+        self.total_attempts = total_attempts
+        self.required_passes = required_passes
+        self.score_threshold = score_threshold
+        self.stopping = stopping
+        self.confidence_z = confidence_z
+        self.min_frames = min_frames
+        self.frames = 0
+        self.passes = 0
+        self.decision = None
+
+    def update(self, similarity_score):
+        # similarity_score is None for attempts where no palm could be scored
+        if self.decision is not None:
+            return self.decision
+
+        self.frames += 1
+        if similarity_score is not None and similarity_score > self.score_threshold:
+            self.passes += 1
+
+        failures = self.frames - self.passes
+        if self.passes >= self.required_passes:
+            self.decision = True
+        elif failures > self.total_attempts - self.required_passes:
+            self.decision = False
+        elif self.stopping == 'confidence' and self.frames >= self.min_frames:
+            low, high = self.pass_rate_interval()
+            required_rate = self.required_passes / self.total_attempts
+            if low >= required_rate:
+                self.decision = True
+            elif high < required_rate:
+                self.decision = False
+        return self.decision
+
+    def pass_rate_interval(self):
+        n, z = self.frames, self.confidence_z
+        rate = self.passes / n
+        denominator = 1 + z * z / n
+        center = (rate + z * z / (2 * n)) / denominator
+        half_width = z * math.sqrt(rate * (1 - rate) / n + z * z / (4 * n * n)) / denominator
+        return center - half_width, center + half_width
+
+    def result(self, user=None):
+        return AuthDecision(self.decision is True, self.frames, self.passes, user)
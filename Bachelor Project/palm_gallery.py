@@ -0,0 +1,256 @@
+import copy
+import ctypes
+import json
+import os
+import struct
+from importlib import metadata
+
+import cv2
+import numpy as np
+
+
+GALLERY_MAGIC = b'PALMGAL2'
+# magic, template count, code bytes, descriptor length, inverted lists, metadata bytes, image bytes
+HEADER = struct.Struct('<8sIIIIIQ')
+DESCRIPTOR_SIZE = 32
+# Code serialization relies on an internal of this edcc release series
+SUPPORTED_EDCC_VERSION = '0.2'
+# Galleries this small are scanned in full; larger ones get about sqrt(templates) inverted lists
+INDEX_MIN_TEMPLATES = 256
+SHORTLIST_SIZE = 8
+PROBED_LISTS = 4
+# Leave-one-out rate at which the shortlist still holds another template of the same user;
+# below it identify() compares every template instead
+MIN_SHORTLIST_RECALL = 0.98
+
+
+def palm_descriptor(palm_image):
+    # Coarse, illumination-normalized thumbnail used to shortlist templates before EDCC
+    gray = cv2.cvtColor(palm_image, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (DESCRIPTOR_SIZE, DESCRIPTOR_SIZE), interpolation=cv2.INTER_AREA)
+    vector = thumbnail.astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def installed_edcc_version():
+    try:
+        return metadata.version('edcc')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+# The edcc package keeps a code's raw bytes in `_code_bytes`, which is what compare_to() reads.
+# That is private API of the 0.2 releases, so the gallery treats stored codes as a cache:
+# with any other release, or codes without that buffer, templates are encoded again from
+# their stored crops through the public encoder.
+def has_code_buffer(code):
+    version = installed_edcc_version()
+    return hasattr(code, '_code_bytes') and version is not None and version.startswith(SUPPORTED_EDCC_VERSION)
+
+
+def code_to_bytes(code):
+    # b'' when the code cannot be stored
+    return bytes(code._code_bytes) if has_code_buffer(code) else b''
+
+
+def code_from_bytes(prototype, raw):
+    if len(raw) != len(prototype._code_bytes):
+        raise ValueError(f'Stored EDCC code has {len(raw)} bytes, the encoder produces {len(prototype._code_bytes)}; '
+                         'was the gallery enrolled with a different EncoderConfig?')
+    code = copy.copy(prototype)
+    if isinstance(prototype._code_bytes, ctypes.Array):
+        code._code_bytes = ctypes.create_string_buffer(bytes(raw), len(raw))
+    else:
+        code._code_bytes = bytes(raw)
+    return code
+
+
+class PalmGallery:
+    # Enrolled users and their templates in one binary file: header, JSON metadata, then
+    # per-template user index, descriptor and pre-encoded EDCC code, a coarse inverted-file
+    # index over the descriptors and each template's palm crop (PNG). load() memory-maps
+    # the arrays, so startup cost does not grow with the gallery.
+    def __init__(self, users=None, template_users=None, descriptors=None, codes=None, images=None,
+                 edcc_version=None):
+        self.users = users or []
+        self.template_users = np.zeros(0, dtype=np.int32) if template_users is None else template_users
+        self.descriptors = (np.zeros((0, DESCRIPTOR_SIZE * DESCRIPTOR_SIZE), dtype=np.float32)
+                            if descriptors is None else descriptors)
+        self.codes = np.zeros((0, 0), dtype=np.uint8) if codes is None else codes
+        # (offsets, bytes): template i's crop is bytes[offsets[i]:offsets[i + 1]]
+        self.images = images or (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint8))
+        self.edcc_version = edcc_version
+        self.index = None
+        self.recall = None
+        # template -> code encoded from its crop, when the stored codes cannot be used
+        self._encoded = {}
+
+    def __len__(self):
+        return len(self.template_users)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic = f.read(len(GALLERY_MAGIC))
+            if magic != GALLERY_MAGIC:
+                raise ValueError(f'{path} is not a palm gallery of this version; enroll the users again')
+            f.seek(0)
+            _, count, code_size, descriptor_size, list_count, metadata_size, image_size = HEADER.unpack(
+                f.read(HEADER.size))
+            metadata = json.loads(f.read(metadata_size))
+
+        arrays = []
+        offset = HEADER.size + metadata_size
+        for dtype, shape in [(np.int32, (count,)), (np.float32, (count, descriptor_size)),
+                             (np.uint8, (count, code_size)), (np.float32, (list_count, descriptor_size)),
+                             (np.int64, (list_count + 1,)), (np.int32, (count,)), (np.int64, (count + 1,)),
+                             (np.uint8, (image_size,))]:
+            if 0 in shape:
+                arrays.append(np.zeros(shape, dtype=dtype))
+                continue
+            arrays.append(np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape))
+            offset += arrays[-1].nbytes
+        template_users, descriptors, codes, centroids, list_offsets, list_templates, image_offsets, images = arrays
+        gallery = cls(metadata['users'], template_users, descriptors, codes, (image_offsets, images),
+                      metadata['edcc_version'])
+        gallery.index = (centroids, list_offsets, list_templates)
+        gallery.recall = metadata['recall']
+        return gallery
+
+    def save(self, path):
+        centroids, list_offsets, list_templates = self.build_index()
+        image_offsets, images = self.images
+        metadata = json.dumps({'users': self.users, 'edcc_version': self.edcc_version,
+                               'recall': self.recall}).encode()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(GALLERY_MAGIC, len(self), self.codes.shape[1], self.descriptors.shape[1],
+                                len(centroids), len(metadata), len(images)))
+            f.write(metadata)
+            for array, dtype in [(self.template_users, np.int32), (self.descriptors, np.float32),
+                                 (self.codes, np.uint8), (centroids, np.float32), (list_offsets, np.int64),
+                                 (list_templates, np.int32), (image_offsets, np.int64), (images, np.uint8)]:
+                f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        os.replace(temp_path, path)
+
+    def add_user(self, name, codes, descriptors, images, boxes=None):
+        # codes: raw EDCC code bytes (code_to_bytes), images: PNG-encoded palm crops, one
+        # each per template; boxes: [(label, file path), ...]
+        names = [user['name'] for user in self.users]
+        if name in names:
+            user_index = names.index(name)
+            if boxes:
+                self.users[user_index]['boxes'] = [list(box) for box in boxes]
+        else:
+            user_index = len(self.users)
+            self.users.append({'name': name, 'boxes': [list(box) for box in boxes or []]})
+
+        new_codes = np.array([np.frombuffer(code, dtype=np.uint8) for code in codes]).reshape(len(codes), -1)
+        if len(self) and new_codes.shape[1] != self.codes.shape[1]:
+            raise ValueError('Templates were encoded with a different EncoderConfig or edcc release; '
+                             'call reencode() first')
+        self.template_users = np.concatenate([self.template_users, np.full(len(codes), user_index, dtype=np.int32)])
+        self.descriptors = np.concatenate([self.descriptors, np.asarray(descriptors, dtype=np.float32)])
+        self.codes = new_codes if not len(self.codes) else np.concatenate([self.codes, new_codes])
+        image_offsets, image_bytes = self.images
+        sizes = np.cumsum([len(image) for image in images], dtype=np.int64)
+        self.images = (np.concatenate([image_offsets, image_offsets[-1] + sizes]),
+                       np.concatenate([image_bytes, np.frombuffer(b''.join(images), dtype=np.uint8)]))
+        self.edcc_version = installed_edcc_version()
+        self.index = self.recall = None
+
+    def template_image(self, template):
+        offsets, images = self.images
+        return cv2.imdecode(np.asarray(images[offsets[template]:offsets[template + 1]]), cv2.IMREAD_COLOR)
+
+    def reencode(self, encode):
+        # Rebuilds the stored codes from the crops with the installed edcc, e.g. before
+        # enrolling more users after an upgrade
+        codes = [code_to_bytes(encode(self.template_image(template))) for template in range(len(self))]
+        self.codes = np.array([np.frombuffer(code, dtype=np.uint8) for code in codes]).reshape(len(codes), -1)
+        self.edcc_version = installed_edcc_version()
+        self._encoded = {}
+
+    def stored_codes_usable(self, prototype):
+        return (self.codes.shape[1] > 0 and self.edcc_version == installed_edcc_version()
+                and has_code_buffer(prototype))
+
+    def template_code(self, template, prototype, encode):
+        if self.stored_codes_usable(prototype):
+            return code_from_bytes(prototype, self.codes[template])
+        if template not in self._encoded:
+            self._encoded[template] = encode(self.template_image(template))
+        return self._encoded[template]
+
+    def build_index(self):
+        # k-means inverted lists over the descriptors, then the shortlist's leave-one-out recall
+        if self.index is not None:
+            return self.index
+        list_count = int(np.sqrt(len(self))) if len(self) >= INDEX_MIN_TEMPLATES else 1
+        if list_count > 1:
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1e-4)
+            _, assignments, centroids = cv2.kmeans(np.ascontiguousarray(self.descriptors, dtype=np.float32),
+                                                   list_count, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+            assignments = assignments.ravel()
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids = centroids / np.where(norms, norms, 1)
+        else:
+            assignments = np.zeros(len(self), dtype=np.int32)
+            centroids = np.zeros((1, self.descriptors.shape[1]), dtype=np.float32)
+        list_templates = np.argsort(assignments, kind='stable').astype(np.int32)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))])
+        self.index = (centroids.astype(np.float32), list_offsets.astype(np.int64), list_templates)
+        self.recall = self.shortlist_recall()
+        return self.index
+
+    def shortlist(self, descriptor, top_k=SHORTLIST_SIZE, probes=PROBED_LISTS, exclude=None):
+        # Descriptor similarity against the templates in the `probes` inverted lists whose
+        # centroids are closest, about probes * sqrt(templates) of them
+        centroids, list_offsets, list_templates = self.build_index()
+        lists = np.argsort(-(centroids @ descriptor))[:probes]
+        candidates = np.concatenate([list_templates[list_offsets[i]:list_offsets[i + 1]] for i in lists])
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        similarities = self.descriptors[candidates] @ descriptor
+        if len(candidates) > top_k:
+            best = np.argpartition(-similarities, top_k)[:top_k]
+            candidates, similarities = candidates[best], similarities[best]
+        return candidates[np.argsort(-similarities)]
+
+    def shortlist_recall(self):
+        # Share of templates whose shortlist (without themselves) holds another template of
+        # the same user; None when no user has two templates
+        template_counts = np.bincount(self.template_users, minlength=len(self.users))
+        hits = queries = 0
+        for template in range(len(self)):
+            user = self.template_users[template]
+            if template_counts[user] < 2:
+                continue
+            queries += 1
+            hits += bool(np.any(self.template_users[self.shortlist(self.descriptors[template], exclude=template)]
+                                == user))
+        return hits / queries if queries else None
+
+    def user_templates(self, user_index, prototype, encode):
+        return [self.template_code(template, prototype, encode)
+                for template in np.flatnonzero(self.template_users == user_index)]
+
+    def identify(self, probe_code, descriptor, encode, threshold=0.01):
+        # Only shortlisted templates go through the (expensive) EDCC comparison, unless the
+        # shortlist's measured recall says it may miss the genuine user
+        self.build_index()
+        if self.recall is not None and self.recall >= MIN_SHORTLIST_RECALL:
+            templates = self.shortlist(descriptor)
+        else:
+            templates = range(len(self))
+        best_template, best_score = None, None
+        for template in templates:
+            score = probe_code.compare_to(self.template_code(template, probe_code, encode))
+            if best_score is None or score > best_score:
+                best_template, best_score = template, score
+        if best_template is None or best_score <= threshold:
+            return None, None, best_score
+        user_index = int(self.template_users[best_template])
+        return user_index, self.users[user_index], best_score
@@ -0,0 +1,260 @@
+import threading
+import time
+from collections import deque
+
+
+class DropOldestQueue:
+    def __init__(self, maxsize=1):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, stop=None):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def get_latest(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            item = self._items.pop()
+            self.dropped += len(self._items)
+            self._items.clear()
+            return item
+
+    def peek(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items[0]
+
+
+class LosslessQueue(DropOldestQueue):
+    # Same interface, but put() waits for room instead of dropping and get_latest() takes
+    # the oldest item: for replays where every frame has to be processed.
+    def put(self, item, stop=None):
+        with self._cond:
+            while len(self._items) == self._items.maxlen:
+                if stop is not None and stop.is_set():
+                    return False
+                self._cond.wait(0.1)
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    get_latest = get
+
+
+class StageStats:
+    def __init__(self, name, window=30):
+        self.name = name
+        self.count = 0
+        self._stamps = deque(maxlen=window)
+        self._busy = deque(maxlen=window)
+
+    def tick(self, busy_time=None):
+        self.count += 1
+        self._stamps.append(time.perf_counter())
+        if busy_time is not None:
+            self._busy.append(busy_time)
+
+    def fps(self):
+        stamps = list(self._stamps)
+        if len(stamps) < 2 or stamps[-1] == stamps[0]:
+            return 0.0
+        return (len(stamps) - 1) / (stamps[-1] - stamps[0])
+
+    def busy_ms(self):
+        busy = list(self._busy)
+        if not busy:
+            return 0.0
+        return 1000 * sum(busy) / len(busy)
+
+
+class CameraStream:
+    def __init__(self, index, cap, process, frame_queue_size=1, result_queue_size=2, lossless=False):
+        queue_type = LosslessQueue if lossless else DropOldestQueue
+        self.index = index
+        self.cap = cap
+        self.process = process
+        self.frames = queue_type(frame_queue_size)
+        # Lossless only: processed (frame_time, frame, output) waiting to be merged in time order
+        self.outputs = queue_type(result_queue_size)
+        self.capture_stats = StageStats(f'capture {index}')
+        self.inference_stats = StageStats(f'inference {index}')
+        # (cap, frame, output, frame_time) of the newest frame with a hand, None after a miss
+        self.latest = None
+        self.captured_all = False
+        self.done = False
+
+
+class GesturePipeline:
+    # Every camera has its own capture and inference thread, and its own `process` (from
+    # make_process(index)) so trackers never see frames from another stream. The caller
+    # is the render/UI stage and pulls (cap, frame, output, frame_time) results with get().
+    # `process(frame, frame_time)` returns None when there are no hands; results come from
+    # the active stream while it sees a hand, and the first other stream that does takes
+    # over as soon as it stops.
+    # frame_time is the cap's `frame_time` attribute after a read (recordings) or the time
+    # it was read. A cap with a `finished` attribute that is set ends its stream, and
+    # `finished` turns true once every stream has ended and been drained.
+    # lossless=True never drops frames and merges the streams in frame_time order, so a
+    # replay renders the same frames in the same order on every run.
+    def __init__(self, caps, make_process, frame_queue_size=1, result_queue_size=2, lossless=False):
+        self.caps = list(caps)
+        self.lossless = lossless
+        self.streams = [CameraStream(index, cap, make_process(index), frame_queue_size, result_queue_size, lossless)
+                        for index, cap in enumerate(self.caps)]
+        self.active_cap = 0
+        self.switches = 0
+        self.results = DropOldestQueue(result_queue_size)
+        self.render_stats = StageStats('render')
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        self._threads = []
+        for stream in self.streams:
+            self._threads.append(threading.Thread(target=self._capture_loop, args=(stream,),
+                                                  name=f'capture-{stream.index}', daemon=True))
+            self._threads.append(threading.Thread(target=self._inference_loop, args=(stream,),
+                                                  name=f'inference-{stream.index}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+
+    @property
+    def finished(self):
+        return (all(stream.done and not len(stream.outputs) for stream in self.streams)
+                and not len(self.results))
+
+    def get(self, timeout=0.05):
+        if self.lossless:
+            return self._next_in_order(timeout)
+        return self.results.get(timeout)
+
+    def _next_in_order(self, timeout):
+        while True:
+            heads = []
+            for stream in self.streams:
+                head = stream.outputs.peek(timeout)
+                if head is None:
+                    if stream.done and not len(stream.outputs):
+                        continue
+                    return None
+                heads.append((head[0], stream.index))
+            if not heads:
+                return None
+            stream = self.streams[min(heads)[1]]
+            frame_time, frame, output = stream.outputs.get()
+            result = self.schedule(stream, frame, output, frame_time)
+            if result is not None:
+                return result
+
+    def _capture_loop(self, stream):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            ret, frame = stream.cap.read()
+            if not ret:
+                if getattr(stream.cap, 'finished', False):
+                    stream.captured_all = True
+                    return
+                continue
+            frame_time = getattr(stream.cap, 'frame_time', None) or time.time()
+            if stream.frames.put((frame_time, frame), self._stop) is False:
+                return
+            stream.capture_stats.tick(time.perf_counter() - start)
+
+    def _inference_loop(self, stream):
+        while not self._stop.is_set():
+            item = stream.frames.get_latest(timeout=0.1)
+            if item is None:
+                if stream.captured_all and not len(stream.frames):
+                    stream.done = True
+                    return
+                continue
+            frame_time, frame = item
+            start = time.perf_counter()
+            output = stream.process(frame, frame_time)
+            stream.inference_stats.tick(time.perf_counter() - start)
+            if self.lossless:
+                stream.outputs.put((frame_time, frame, output), self._stop)
+                continue
+            result = self.schedule(stream, frame, output, frame_time)
+            if result is not None:
+                self.results.put(result)
+
+    def schedule(self, stream, frame, output, frame_time):
+        # Returns the (cap, frame, output, frame_time) to render, if any
+        with self._lock:
+            stream.latest = (stream.cap, frame, output, frame_time) if output is not None else None
+            if stream.index == self.active_cap:
+                if stream.latest is not None:
+                    return stream.latest
+                for other in self.streams:
+                    if other.latest is not None:
+                        # Hand the newest frame of a stream that still sees a hand straight to the renderer
+                        self.active_cap = other.index
+                        self.switches += 1
+                        return other.latest
+                return None
+            if stream.latest is not None and self.streams[self.active_cap].latest is None:
+                self.active_cap = stream.index
+                self.switches += 1
+                return stream.latest
+            return None
+
+    def stats(self):
+        return {
+            'streams': [{'capture': {'fps': stream.capture_stats.fps(), 'ms': stream.capture_stats.busy_ms()},
+                         'inference': {'fps': stream.inference_stats.fps(), 'ms': stream.inference_stats.busy_ms()},
+                         'frame_queue': len(stream.frames),
+                         'frames_dropped': stream.frames.dropped}
+                        for stream in self.streams],
+            'render': {'fps': self.render_stats.fps(), 'ms': self.render_stats.busy_ms()},
+            'active_cap': self.active_cap,
+            'switches': self.switches,
+            'result_queue': len(self.results),
+            'results_dropped': self.results.dropped,
+        }
+
+    def stats_lines(self):
+        stats = self.stats()
+        lines = []
+        for index, stream in enumerate(stats['streams']):
+            marker = '*' if index == stats['active_cap'] else ' '
+            lines.append(f"{marker}cam {index}: capture {stream['capture']['fps']:.1f} fps {stream['capture']['ms']:.1f} ms, "
+                         f"inference {stream['inference']['fps']:.1f} fps {stream['inference']['ms']:.1f} ms, "
+                         f"dropped {stream['frames_dropped']}")
+        lines.append(f"render: {stats['render']['fps']:.1f} fps {stats['render']['ms']:.1f} ms")
+        lines.append(f"results {stats['result_queue']} (dropped {stats['results_dropped']}), "
+                     f"camera switches {stats['switches']}")
+        return lines
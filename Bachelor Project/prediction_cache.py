@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+
+
+class PredictionCache:
+    # Reuses the last model prediction while the normalized landmarks stay within
+    # `epsilon` (largest coordinate change, in normalized image units) of the vector that
+    # was last classified, and for at most `max_age` seconds. Comparing against the
+    # classified vector rather than the previous frame means slow drift still re-classifies.
+    # Keeps per-instance state: use one cache per inference thread.
+    def __init__(self, predict, epsilon=0.01, max_age=0.5, clock=time.monotonic):
+        self.predict = predict
+        self.epsilon = epsilon
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.predict_time = 0.0
+        self._features = None
+        self._prediction = None
+        self._classified_at = 0.0
+
+    def __call__(self, features, now=None):
+        # now: e.g. the frame's capture time, so cache expiry is reproducible in replays
+        if now is None:
+            now = self.clock()
+        if (self._features is not None and now - self._classified_at <= self.max_age
+                and np.abs(features - self._features).max() <= self.epsilon):
+            self.hits += 1
+            return self._prediction
+
+        start = time.perf_counter()
+        self._prediction = self.predict([features])
+        self.predict_time += time.perf_counter() - start
+        self.misses += 1
+        self._features = np.array(features, copy=True)
+        self._classified_at = now
+        return self._prediction
+
+    def reset(self):
+        self._features = None
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def saved_ms(self):
+        # Estimated from the average cost of the predictions that did run
+        if not self.misses:
+            return 0.0
+        return 1000 * self.hits * self.predict_time / self.misses
+
+    def stats_line(self):
+        return (f"classifier cache: {100 * self.hit_rate():.0f}% hits "
+                f"({self.hits}/{self.hits + self.misses}), ~{self.saved_ms():.0f} ms saved")
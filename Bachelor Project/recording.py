@@ -0,0 +1,163 @@
+import json
+import os
+import random
+import threading
+import time
+
+import cv2
+
+
+RECORDING_FOURCC = 'MJPG'
+RECORDING_FPS = 30
+METADATA_FILE = 'recording.json'
+
+
+def stream_paths(directory, index):
+    return os.path.join(directory, f'cam{index}.avi'), os.path.join(directory, f'cam{index}.txt')
+
+
+class FrameClock:
+    # The time the app logic sees: the capture time of the frame being handled. Live that
+    # is close to time.time(); in a replay it is the recorded time, so dwell, cooldown and
+    # swipe windows come out the same on every run no matter how fast frames are processed.
+    def __init__(self, now=None):
+        self.now = time.time() if now is None else now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, frame_time):
+        self.now = max(self.now, frame_time)
+
+
+class RecordingCapture:
+    # Passes a cv2.VideoCapture through and writes every frame it reads, with its
+    # time.time() capture time, to cam<index>.avi / cam<index>.txt in `directory`.
+    def __init__(self, cap, directory, index):
+        self.cap = cap
+        self.video_path, self.stamps_path = stream_paths(directory, index)
+        os.makedirs(directory, exist_ok=True)
+        self.frame_time = None
+        self._writer = None
+        self._stamps = open(self.stamps_path, 'w')
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return ret, frame
+        self.frame_time = time.time()
+        with self._lock:
+            if self._stamps.closed:
+                return ret, frame
+            if self._writer is None:
+                height, width = frame.shape[:2]
+                self._writer = cv2.VideoWriter(self.video_path, cv2.VideoWriter_fourcc(*RECORDING_FOURCC),
+                                               RECORDING_FPS, (width, height))
+            self._writer.write(frame)
+            self._stamps.write(f'{self.frame_time:.6f}\n')
+        return ret, frame
+
+    def release(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.release()
+            self._stamps.close()
+        self.cap.release()
+
+
+class ReplayPacer:
+    # Shared by the streams of one replay so real-time pacing uses a common origin
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self._origin = None
+        self._lock = threading.Lock()
+
+    def wait(self, frame_time):
+        if not self.realtime:
+            return
+        with self._lock:
+            if self._origin is None:
+                self._origin = (time.perf_counter(), frame_time)
+            start, first_frame_time = self._origin
+        delay = start + frame_time - first_frame_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ReplayCapture:
+    # Reads a stream written by RecordingCapture back with the cv2.VideoCapture interface.
+    # frame_time is the recorded capture time of the last frame read; once the stream
+    # runs out read() keeps returning (False, None) and `finished` is set.
+    def __init__(self, directory, index, pacer=None):
+        video_path, stamps_path = stream_paths(directory, index)
+        self.video = cv2.VideoCapture(video_path)
+        with open(stamps_path) as f:
+            self.frame_times = [float(line) for line in f if line.strip()]
+        self.pacer = pacer or ReplayPacer()
+        self.position = 0
+        self.frame_time = None
+        self.finished = False
+
+    def read(self):
+        if self.finished:
+            return False, None
+        ret, frame = self.video.read()
+        if not ret or self.position >= len(self.frame_times):
+            self.finished = True
+            return False, None
+        self.frame_time = self.frame_times[self.position]
+        self.position += 1
+        self.pacer.wait(self.frame_time)
+        return True, frame
+
+    def set(self, prop_id, value):
+        return False
+
+    def release(self):
+        self.video.release()
+
+
+def record_captures(caps, directory):
+    return [RecordingCapture(cap, directory, index) for index, cap in enumerate(caps)]
+
+
+def replay_captures(directory, count, realtime=False):
+    pacer = ReplayPacer(realtime)
+    return [ReplayCapture(directory, index, pacer) for index in range(count)]
+
+
+def write_metadata(directory, metadata):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def read_metadata(directory):
+    path = os.path.join(directory, METADATA_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def session_seed(record_dir=None, replay_dir=None):
+    # Seed for everything random in a session (box positions). A recording stores it
+    # and a replay reuses it, so the layout matches the recorded run.
+    if replay_dir:
+        seed = read_metadata(replay_dir).get('seed')
+        if seed is None:
+            print(f"{replay_dir} has no {METADATA_FILE} seed; box positions will differ from the recording")
+        return seed
+    seed = random.randrange(2 ** 32)
+    if record_dir:
+        write_metadata(record_dir, {'seed': seed})
+    return seed
+
+
+def recording_start_time(caps):
+    frame_times = [cap.frame_times[0] for cap in caps if cap.frame_times]
+    return min(frame_times) if frame_times else None
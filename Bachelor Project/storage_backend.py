@@ -0,0 +1,117 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+PHALANGE_COUNT = 12
+LOCAL_STORAGE_DIR = 'local_storage'
+DIGEST_SIZE = 32
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StorageBackend:
+    # Where placed boxes go. Slots are addressed by phalange (1-12) and layer (1-based).
+    # place() returns False when the slot is already taken; peek() says whether a slot
+    # holds something; list() returns the occupied (phalange, layer) slots. None of them
+    # may block on the network: until ready() a backend refuses placements and reports
+    # its slots as empty. A backend that writes in the background accepts a placement
+    # straight away and, should the write fail for good, empties the slot again and calls
+    # on_failed() from poll().
+    name = None
+    placement_cooldown = 5
+
+    def start(self):
+        pass
+
+    def ready(self):
+        return True
+
+    def poll(self):
+        pass
+
+    def status_line(self):
+        return None
+
+    def drain(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def place(self, phalange, layer, file_path, on_failed=None):
+        raise NotImplementedError
+
+    def peek(self, phalange, layer):
+        raise NotImplementedError
+
+    def clear(self, slots):
+        raise NotImplementedError
+
+    def list(self, layer=None):
+        raise NotImplementedError
+
+
+class LocalDiskBackend(StorageBackend):
+    # Slot table is a memory-mapped (layer, phalange) array of sha256 digests (all zeros
+    # means empty) and the files themselves live once per content in a blob directory,
+    # so the storage survives restarts and every operation is a local array access.
+    name = 'Local'
+
+    def __init__(self, layer_count, root=LOCAL_STORAGE_DIR):
+        self.layer_count = layer_count
+        self.blob_dir = os.path.join(root, 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        table_path = os.path.join(root, 'slots.bin')
+        shape = (layer_count, PHALANGE_COUNT, DIGEST_SIZE)
+        if os.path.exists(table_path) and os.path.getsize(table_path) == int(np.prod(shape)):
+            self.slots = np.memmap(table_path, dtype=np.uint8, mode='r+', shape=shape)
+        else:
+            self.slots = np.memmap(table_path, dtype=np.uint8, mode='w+', shape=shape)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def place(self, phalange, layer, file_path, on_failed=None):
+        # Written before returning, so on_failed is never called
+        if self.peek(phalange, layer):
+            return False
+        digest = file_digest(file_path)
+        blob_path = self.blob_path(digest)
+        if not os.path.exists(blob_path):
+            shutil.copyfile(file_path, blob_path + '.tmp')
+            os.replace(blob_path + '.tmp', blob_path)
+        self.slots[layer - 1, phalange - 1] = np.frombuffer(bytes.fromhex(digest), dtype=np.uint8)
+        self.slots.flush()
+        return True
+
+    def peek(self, phalange, layer):
+        return bool(self.slots[layer - 1, phalange - 1].any())
+
+    def get(self, phalange, layer):
+        if not self.peek(phalange, layer):
+            return None
+        return self.blob_path(self.slots[layer - 1, phalange - 1].tobytes().hex())
+
+    def clear(self, slots):
+        digests = {self.slots[layer - 1, phalange - 1].tobytes() for phalange, layer in slots}
+        for phalange, layer in slots:
+            self.slots[layer - 1, phalange - 1] = 0
+        self.slots.flush()
+        # Drop blobs no slot refers to any more
+        stored = {row.tobytes() for row in self.slots.reshape(-1, DIGEST_SIZE)}
+        for digest in digests - stored:
+            if any(digest) and os.path.exists(self.blob_path(digest.hex())):
+                os.remove(self.blob_path(digest.hex()))
+
+    def list(self, layer=None):
+        occupied = self.slots.any(axis=-1)
+        return [(int(phalange) + 1, int(layer_index) + 1) for layer_index, phalange in np.argwhere(occupied)
+                if layer is None or layer_index + 1 == layer]
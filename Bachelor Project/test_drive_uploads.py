@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip('googleapiclient')
+
+from drive_uploads import UploadCache, collect_blobs, session_status
+from fake_drive import FakeDriveService
+
+
+class Response(dict):
+    # httplib2's response: a dict of lower-cased headers with a status
+    def __init__(self, status, headers=()):
+        super().__init__(headers)
+        self.status = status
+
+
+class SessionHttp:
+    def __init__(self, response, content=b''):
+        self.response = response
+        self.content = content
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        self.requests.append((uri, method, headers))
+        return self.response, self.content
+
+
+def test_session_status_asks_with_an_empty_put():
+    http = SessionHttp(Response(308, {'range': 'bytes=0-262143'}))
+    assert session_status(http, 'https://upload/session', 1000000) == (262144, None)
+    uri, method, headers = http.requests[0]
+    assert (uri, method) == ('https://upload/session', 'PUT')
+    assert headers['Content-Range'] == 'bytes */1000000'
+
+
+def test_session_status_of_new_finished_and_expired_sessions():
+    assert session_status(SessionHttp(Response(308)), 'uri', 10) == (0, None)
+    assert session_status(SessionHttp(Response(200), b'{"id": "blob"}'), 'uri', 10) == (10, {'id': 'blob'})
+    assert session_status(SessionHttp(Response(404)), 'uri', 10) == (None, None)
+    with pytest.raises(Exception):
+        session_status(SessionHttp(Response(503)), 'uri', 10)
+
+
+def test_digest_keeps_one_entry_per_path(tmp_path):
+    path = tmp_path / 'box.png'
+    path.write_bytes(b'first')
+    cache = UploadCache(None)
+    first = cache.digest(str(path))
+    path.write_bytes(b'second, longer')
+    assert cache.digest(str(path)) != first
+    assert len(cache.data['hashes']) == 1
+
+
+def test_collect_blobs_deletes_unreferenced_masters_beyond_keep():
+    service = FakeDriveService()
+    cache = UploadCache(None)
+    for digest in ['a', 'b', 'c']:
+        cache.blobs[digest] = service.add_file(digest)['id']
+        cache.add_placed(service.add_file(f'copy of {digest}')['id'], digest)
+    copies = {digest: file_id for file_id, digest in cache.placed.items()}
+    blobs = dict(cache.blobs)
+    cache.data['blob_used'].update({'a': 1, 'b': 2, 'c': 3})
+
+    # 'a' is still placed, 'b' and 'c' are not; only the most recently placed one is kept
+    collect_blobs(service, cache, [copies['b'], copies['c']], keep=1, log=lambda message: None)
+    assert set(cache.blobs) == {'a', 'c'}
+    assert set(cache.placed.values()) == {'a'}
+    assert blobs['b'] not in service.file_table
+    assert blobs['a'] in service.file_table and blobs['c'] in service.file_table
@@ -0,0 +1,163 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import drive_worker
+from drive_worker import StorageWorker
+from fake_drive import FakeDriveService
+from metrics import Counter
+
+
+def create_file(service):
+    return service.files().create(body={'name': 'box.png'}).execute()['id']
+
+
+def make_worker(service, messages=None, failures=None):
+    log = messages.append if messages is not None else (lambda message: None)
+    return StorageWorker(lambda: service, max_retries=5, base_delay=0.01, max_delay=0.04, log=log, failures=failures)
+
+
+def finish(worker, timeout=5.0):
+    # poll() until nothing is pending, the way the frame loop would
+    finished = []
+    deadline = time.monotonic() + timeout
+    while worker.pending:
+        assert time.monotonic() < deadline, 'worker did not finish'
+        finished += worker.poll()
+        time.sleep(0.001)
+    return finished
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Backoff waits are recorded instead of slept
+    delays = []
+    monkeypatch.setattr(drive_worker, 'time', SimpleNamespace(sleep=delays.append))
+    return delays
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retries_throttling_and_server_errors_with_backoff(status, sleeps):
+    service = FakeDriveService()
+    service.fail_next(3, status)
+    worker = make_worker(service)
+    operation = worker.submit('create', create_file)
+    finish(worker)
+    worker.stop()
+
+    assert operation.status == 'done'
+    assert operation.result in service.file_table
+    assert operation.attempts == 3
+    assert worker.retries == 3
+    assert service.round_trips == 4
+    # Jittered exponential backoff: each wait is 50-100% of a delay that doubles up to max_delay
+    for delay, cap in zip(sleeps, [0.01, 0.02, 0.04]):
+        assert 0.5 * cap <= delay <= cap
+
+
+def test_retries_transport_errors(sleeps):
+    service = FakeDriveService()
+    errors = [ConnectionResetError('reset'), TimeoutError('timed out')]
+
+    def flaky(service):
+        if errors:
+            raise errors.pop(0)
+        return create_file(service)
+
+    worker = make_worker(service)
+    operation = worker.submit('create', flaky)
+    finish(worker)
+    worker.stop()
+
+    assert operation.status == 'done'
+    assert operation.attempts == 2
+    assert len(sleeps) == 2
+
+
+def test_gives_up_after_max_retries(sleeps):
+    service = FakeDriveService()
+    service.fail_next(10, 503)
+    worker = make_worker(service)
+    operation = worker.submit('create', create_file)
+    finish(worker)
+    worker.stop()
+
+    assert operation.status == 'failed'
+    assert operation.attempts == worker.max_retries + 1
+    assert service.round_trips == worker.max_retries + 1
+
+
+@pytest.mark.parametrize('status', [400, 403, 404])
+def test_fails_at_once_on_client_errors(status, sleeps):
+    service = FakeDriveService()
+    service.fail_next(1, status)
+    messages = []
+    failures = Counter('drive.failures')
+    worker = make_worker(service, messages, failures)
+    operation = worker.submit('create', create_file)
+    finish(worker)
+    worker.stop()
+
+    assert operation.status == 'failed'
+    assert operation.attempts == 1
+    assert service.round_trips == 1
+    assert not sleeps
+    assert worker.failed == [operation]
+    assert failures.value == 1
+    assert any('create' in message for message in messages)
+
+
+def test_fails_at_once_on_bugs(sleeps):
+    worker = make_worker(FakeDriveService())
+    operation = worker.submit('broken', lambda service: {}['id'])
+    finish(worker)
+    worker.stop()
+
+    assert operation.status == 'failed'
+    assert isinstance(operation.error, KeyError)
+    assert not sleeps
+
+
+def test_on_done_runs_in_poll_on_the_calling_thread():
+    service = FakeDriveService()
+    worker = make_worker(service)
+    calls = []
+    operation = worker.submit('create', create_file,
+                              lambda operation: calls.append((operation, threading.current_thread())))
+
+    deadline = time.monotonic() + 5.0
+    while not worker._finished.qsize():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    # Finished on the worker thread, but nothing is delivered until poll()
+    assert operation.status == 'done'
+    assert not calls
+    assert worker.pending == 1
+
+    assert worker.poll() == [operation]
+    assert calls == [(operation, threading.current_thread())]
+    assert worker.pending == 0
+    worker.stop()
+
+
+def test_failed_placement_empties_the_slot_and_calls_on_failed():
+    pytest.importorskip('googleapiclient')
+    pytest.importorskip('google_auth_oauthlib')
+    from drive_backend import fake_drive_backend
+
+    backend = fake_drive_backend(1, log=lambda message: None)
+    backend.occupancy.sweep()
+    backend.worker.base_delay = 0
+    backend.service.fail_next(1, 400)
+    failed = []
+    assert backend.place(1, 1, __file__, lambda: failed.append(True))
+    # Optimistically full while the upload is queued
+    assert backend.peek(1, 1)
+
+    backend.drain()
+    assert failed == [True]
+    assert not backend.peek(1, 1)
+    assert backend.list(1) == []
+    backend.stop()
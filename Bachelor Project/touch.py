@@ -0,0 +1,128 @@
+import numpy as np
+
+from features import FINGER_LANDMARKS, FINGER_PRIORITY, INDEX_FINGER_TIP
+
+
+PHALANGE_PARTS = ['top of', 'middle of', 'bottom of']
+
+
+def phalange_targets(fingers=FINGER_PRIORITY):
+    # target name -> landmark index in priority order, e.g. 'top of index' -> 8.
+    # Pass ['Thumb'] + FINGER_PRIORITY to make the thumb touchable too.
+    return {f'{part} {finger.split()[0].lower()}': landmark
+            for finger in fingers for part, landmark in zip(PHALANGE_PARTS, FINGER_LANDMARKS[finger])}
+
+
+class Touch:
+    # pointer_hand is the pointing hand's row in this frame's hand_points; pointer_id is its
+    # handedness label, or the row when there are no usable labels
+    def __init__(self, target, target_index, pointer_hand, pointer_id, pointer_point, target_point, distance):
+        self.target = target
+        self.target_index = target_index
+        self.pointer_hand = pointer_hand
+        self.pointer_id = pointer_id
+        self.pointer_point = pointer_point
+        self.target_point = target_point
+        self.distance = distance
+
+    @property
+    def key(self):
+        # MediaPipe may list the hands in either order from one frame to the next, so
+        # debouncing follows the handedness label rather than the row
+        return self.pointer_id, self.target_index
+
+    def __repr__(self):
+        return 'Touch(target={!r}, pointer_hand={}, distance={:.3f})'.format(
+            self.target, self.pointer_hand, self.distance)
+
+
+class TouchDetector:
+    # The pointer fingertip of one hand touching a target landmark of the other hand.
+    # Distances for both directions (each hand pointing at the other) come from one array
+    # operation. With MediaPipe handedness labels only `pointer_hand`'s fingertip counts,
+    # otherwise either hand may point. A touch starts on the first target in priority
+    # order (index to pinky, top to bottom, like Main's original loop) below enter_threshold
+    # and holds until exit_threshold; starting, changing or releasing a touch has to
+    # persist for debounce_frames consecutive frames first.
+    def __init__(self, targets=None, pointer=INDEX_FINGER_TIP, pointer_hand='Left',
+                 enter_threshold=0.1, exit_threshold=0.12, debounce_frames=2):
+        self.targets = targets or phalange_targets()
+        self.target_names = list(self.targets)
+        self.target_landmarks = np.array(list(self.targets.values()))
+        # Fancy-index tables so both directions are gathered in one indexing operation each
+        self._target_hands = np.repeat([[1], [0]], len(self.target_landmarks), axis=1)
+        self._target_rows = np.tile(self.target_landmarks, (2, 1))
+        self.pointer = pointer
+        self.pointer_hand = pointer_hand
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.debounce_frames = debounce_frames
+        self.touch = None
+        self._candidate = None
+        self._candidate_frames = 0
+
+    def distances(self, points):
+        # points: (2, 21, 3) -> (2, targets); row h is hand h's pointer against the other hand
+        offsets = points[self._target_hands, self._target_rows] - points[:, self.pointer, None]
+        return np.sqrt(np.einsum('hti,hti->ht', offsets, offsets))
+
+    def hand_ids(self, handedness):
+        # Handedness labels when there is one of each, otherwise the rows
+        if handedness and len(handedness) == 2 and handedness[0] != handedness[1]:
+            return list(handedness)
+        return [0, 1]
+
+    def pointer_rows(self, hand_ids):
+        if self.pointer_hand in hand_ids:
+            return [hand_ids.index(self.pointer_hand)]
+        return [0, 1]
+
+    def detect(self, hand_points, handedness=None):
+        # Raw (undebounced) touch for this frame, or None
+        if len(hand_points) != 2:
+            return None
+        points = np.stack(hand_points)
+        distances = self.distances(points)
+        hand_ids = self.hand_ids(handedness)
+        rows = self.pointer_rows(hand_ids)
+
+        if self.touch is not None:
+            pointer_id, target_index = self.touch.key
+            if pointer_id in hand_ids:
+                row = hand_ids.index(pointer_id)
+                if row in rows and distances[row, target_index] < self.exit_threshold:
+                    return self._touch(points, distances, hand_ids, row, target_index)
+
+        allowed = distances[rows]
+        touching = np.flatnonzero(allowed.min(axis=0) < self.enter_threshold)
+        if not touching.size:
+            return None
+        target_index = int(touching[0])
+        row = rows[int(allowed[:, target_index].argmin())]
+        return self._touch(points, distances, hand_ids, row, target_index)
+
+    def update(self, hand_points, handedness=None):
+        touch = self.detect(hand_points, handedness)
+        key = touch.key if touch is not None else None
+
+        if key == (self.touch.key if self.touch is not None else None):
+            self._candidate, self._candidate_frames = None, 0
+            self.touch = touch
+            return self.touch
+
+        if key == self._candidate:
+            self._candidate_frames += 1
+        else:
+            self._candidate, self._candidate_frames = key, 1
+        if self._candidate_frames >= self.debounce_frames:
+            self.touch = touch
+            self._candidate, self._candidate_frames = None, 0
+        return self.touch
+
+    def reset(self):
+        self.touch = None
+        self._candidate, self._candidate_frames = None, 0
+
+    def _touch(self, points, distances, hand_ids, row, target_index):
+        return Touch(self.target_names[target_index], target_index, row, hand_ids[row], points[row, self.pointer],
+                     points[1 - row, self.target_landmarks[target_index]], float(distances[row, target_index]))
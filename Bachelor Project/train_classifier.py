@@ -1,28 +1,243 @@
+import argparse
+import io
+import json
+import os
 import pickle
+import time
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
+from joblib import Parallel, delayed
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import ParameterGrid, StratifiedKFold, cross_val_score, train_test_split
 from sklearn.metrics import accuracy_score
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.svm import SVC
 import numpy as np
 
+from features import FEATURE_SIZE
+from forest_export import compile_forest
+from gesture_labels import save_labels
 
-data_dict = pickle.load(open('./data.pickle', 'rb'))
 
-data = np.asarray(data_dict['data'])
-labels = np.asarray(data_dict['labels'])
+# Depth/size-constrained forests exported next to the full model for slower machines
+MODEL_VARIANTS = [
+    ('model_50x12.npz', {'n_estimators': 50, 'max_depth': 12}),
+    ('model_20x8.npz', {'n_estimators': 20, 'max_depth': 8}),
+]
 
-x_train, x_test, y_train, y_test = train_test_split(data, labels, test_size=0.2, shuffle=True, stratify=labels)
+# Searched by --select: (name, estimator class, parameter grid)
+CANDIDATES = [
+    ('random_forest', RandomForestClassifier, {'n_estimators': [20, 50, 100], 'max_depth': [8, 12, None]}),
+    ('extra_trees', ExtraTreesClassifier, {'n_estimators': [20, 50, 100], 'max_depth': [12, None]}),
+    ('knn', KNeighborsClassifier, {'n_neighbors': [3, 5, 9]}),
+    ('logistic_regression', LogisticRegression, {'C': [0.1, 1, 10], 'max_iter': [2000]}),
+    ('svm', SVC, {'C': [1, 10], 'gamma': ['scale']}),
+]
+CV_FOLDS = 5
+# Single-row p99 prediction latency the chosen model has to stay under, per frame
+LATENCY_BUDGET_MS = 2.0
+LATENCY_REPEATS = 3
+REPORT_PATH = 'model_selection.json'
+# Feature store keys the current model.p was trained on, for update_classifier.py
+TRAINING_STATE_PATH = 'training_state.json'
 
-model = RandomForestClassifier()
 
-model.fit(x_train, y_train)
+def load_data(path='./data.pickle'):
+    data_dict = pickle.load(open(path, 'rb'))
 
-y_predict = model.predict(x_test)
+    data = np.asarray(data_dict['data'], dtype=np.float32)
+    labels = np.asarray(data_dict['labels'])
 
-score = accuracy_score(y_predict, y_test)
+    if data.ndim != 2 or data.shape[1] != FEATURE_SIZE:
+        raise ValueError(f'Expected {FEATURE_SIZE} features per sample, got shape {data.shape}; rerun create_dataset.py')
+    # Older data.pickle files have no feature store keys
+    return data, labels, data_dict.get('keys')
 
-print('{}% of samples were classified correctly !'.format(score * 100))
 
-f = open('model.p', 'wb')
-pickle.dump({'model': model}, f)
-f.close()
+def load_trained_keys(path=TRAINING_STATE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return set(json.load(f)['keys'])
+
+
+def save_trained_keys(keys, path=TRAINING_STATE_PATH):
+    if keys is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'keys': sorted(keys)}, f)
+    os.replace(temp_path, path)
+
+
+def is_forest(model):
+    return isinstance(model, (RandomForestClassifier, ExtraTreesClassifier))
+
+
+def deployed(model):
+    # What Main.py would load: forests as a CompiledForest, anything else as the fitted estimator
+    return compile_forest(model) if is_forest(model) else model
+
+
+def serialized_size(model):
+    buffer = io.BytesIO()
+    if is_forest(model):
+        compile_forest(model).save(buffer)
+    else:
+        pickle.dump({'model': model}, buffer)
+    return buffer.tell()
+
+
+def prediction_latency(model, rows, repeats=LATENCY_REPEATS):
+    latencies = []
+    for _ in range(repeats):
+        for row in rows:
+            start = time.perf_counter()
+            model.predict([row])
+            latencies.append(time.perf_counter() - start)
+    latencies = 1000 * np.array(latencies)
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def evaluate(name, estimator, params, x_train, y_train, x_test, y_test, folds):
+    # One grid point: cross-validated on the training split, then fitted on all of it
+    model = estimator(**params)
+    cv_scores = cross_val_score(model, x_train, y_train, cv=StratifiedKFold(folds, shuffle=True, random_state=0),
+                                n_jobs=1)
+    model.fit(x_train, y_train)
+    return {
+        'name': name,
+        'params': params,
+        'cv_accuracy': float(cv_scores.mean()),
+        'cv_std': float(cv_scores.std()),
+        'test_accuracy': float(accuracy_score(y_test, model.predict(x_test))),
+    }, model
+
+
+def pareto_front(results):
+    # Candidates no other candidate beats on both cross-validated accuracy and p99 latency
+    front = []
+    for result in results:
+        dominated = any(other['cv_accuracy'] >= result['cv_accuracy'] and other['p99_ms'] <= result['p99_ms']
+                        and (other['cv_accuracy'] > result['cv_accuracy'] or other['p99_ms'] < result['p99_ms'])
+                        for other in results)
+        if not dominated:
+            front.append(result)
+    return front
+
+
+def select_model(x_train, y_train, x_test, y_test, latency_budget_ms=LATENCY_BUDGET_MS, folds=CV_FOLDS, n_jobs=-1):
+    grid = [(name, estimator, params) for name, estimator, space in CANDIDATES for params in ParameterGrid(space)]
+    print(f'Cross-validating {len(grid)} candidates ({folds} folds)...')
+    evaluated = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate)(name, estimator, params, x_train, y_train, x_test, y_test, folds)
+        for name, estimator, params in grid)
+
+    # Latency is measured afterwards, one model at a time, so the parallel fits do not skew it
+    results = []
+    models = []
+    for result, model in evaluated:
+        result['p50_ms'], result['p99_ms'] = prediction_latency(deployed(model), x_test)
+        result['size_kb'] = serialized_size(model) / 1024
+        results.append(result)
+        models.append(model)
+
+    front = pareto_front(results)
+    for result in results:
+        result['pareto'] = result in front
+    within_budget = [result for result in front if result['p99_ms'] <= latency_budget_ms]
+    if within_budget:
+        chosen = max(within_budget, key=lambda result: (result['cv_accuracy'], -result['p99_ms']))
+    else:
+        print(f'No candidate meets the {latency_budget_ms} ms budget; taking the fastest')
+        chosen = min(front, key=lambda result: result['p99_ms'])
+    return chosen, models[results.index(chosen)], results
+
+
+def save_model(model, names=None):
+    # Main.py prefers model.npz over model.p, so a stale one has to go when a non-forest wins
+    f = open('model.p', 'wb')
+    pickle.dump({'model': model}, f)
+    f.close()
+    if is_forest(model):
+        compile_forest(model).save('model.npz')
+    elif os.path.exists('model.npz'):
+        os.remove('model.npz')
+    return save_labels('model.p', model.classes_, names)
+
+
+def print_results(results, chosen):
+    print('{:<20} {:<42} {:>8} {:>8} {:>8} {:>8} {:>9}'.format(
+        'model', 'params', 'cv acc', 'test acc', 'p50 ms', 'p99 ms', 'size KB'))
+    for result in sorted(results, key=lambda result: -result['cv_accuracy']):
+        marker = '*' if result is chosen else ('+' if result['pareto'] else ' ')
+        print('{}{:<19} {:<42} {:>7.2f}% {:>7.2f}% {:>8.3f} {:>8.3f} {:>9.1f}'.format(
+            marker, result['name'], json.dumps(result['params']), 100 * result['cv_accuracy'],
+            100 * result['test_accuracy'], result['p50_ms'], result['p99_ms'], result['size_kb']))
+    print('* chosen, + Pareto front (accuracy vs. p99 latency)')
+
+
+def train_default(x_train, y_train, x_test, y_test):
+    model = RandomForestClassifier()
+
+    model.fit(x_train, y_train)
+
+    y_predict = model.predict(x_test)
+
+    score = accuracy_score(y_predict, y_test)
+
+    print('{}% of samples were classified correctly !'.format(score * 100))
+
+    save_model(model)
+
+    for path, params in MODEL_VARIANTS:
+        variant = RandomForestClassifier(**params)
+        variant.fit(x_train, y_train)
+        score = accuracy_score(variant.predict(x_test), y_test)
+        compile_forest(variant).save(path)
+        print('{}: {}% of samples were classified correctly !'.format(path, score * 100))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the gesture classifier')
+    parser.add_argument('--select', action='store_true',
+                        help='cross-validate a grid of classifiers in parallel and keep the most accurate one '
+                             'on the accuracy/latency Pareto front that fits the latency budget')
+    parser.add_argument('--latency-budget-ms', type=float, default=LATENCY_BUDGET_MS,
+                        help='single-row p99 prediction latency budget for --select')
+    parser.add_argument('--folds', type=int, default=CV_FOLDS)
+    parser.add_argument('--jobs', type=int, default=-1, help='parallel jobs for --select (default: all cores)')
+    parser.add_argument('--report', default=REPORT_PATH, help='where --select writes its report')
+    args = parser.parse_args()
+
+    data, labels, keys = load_data()
+    x_train, x_test, y_train, y_test = train_test_split(data, labels, test_size=0.2, shuffle=True, stratify=labels)
+
+    if args.select:
+        start = time.perf_counter()
+        chosen, model, results = select_model(x_train, y_train, x_test, y_test, args.latency_budget_ms,
+                                              args.folds, args.jobs)
+        print_results(results, chosen)
+        save_model(model)
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'samples': int(len(data)),
+            'classes': sorted(str(label) for label in np.unique(labels)),
+            'folds': args.folds,
+            'latency_budget_ms': args.latency_budget_ms,
+            'search_seconds': time.perf_counter() - start,
+            'chosen': chosen,
+            'artifact': 'model.npz' if is_forest(model) else 'model.p',
+            'candidates': results,
+        }
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Chose {chosen['name']} {json.dumps(chosen['params'])}: {100 * chosen['cv_accuracy']:.2f}% cv accuracy, "
+              f"p99 {chosen['p99_ms']:.3f} ms; wrote {report['artifact']} and {args.report}")
+    else:
+        train_default(x_train, y_train, x_test, y_test)
+    save_trained_keys(keys)
+
+    np.savez('test_split.npz', x_test=x_test, y_test=y_test)
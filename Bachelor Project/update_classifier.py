@@ -0,0 +1,85 @@
+import argparse
+import time
+
+import numpy as np
+from sklearn.base import clone
+
+from feature_store import FeatureStore, write_dataset
+from forest_export import load_model
+from train_classifier import is_forest, load_trained_keys, save_model, save_trained_keys
+
+
+FEATURE_STORE_DIR = './features'
+# Trees added per update when the new samples only belong to gestures the model knows
+ADDED_TREES = 20
+# Past this many trees an update refits from scratch with REFIT_TREES (what train_classifier.py
+# fits), so warm starts do not grow the forest and its prediction time without bound
+MAX_TREES = 200
+REFIT_TREES = 100
+
+
+def update_model(model, data, labels, keys, trained_keys, added_trees=ADDED_TREES, max_trees=MAX_TREES):
+    # Returns (model, what was done). Without a training state (a model trained from an
+    # older data.pickle) the model is assumed to have seen every stored sample of the
+    # classes it already has.
+    if trained_keys is None:
+        new = ~np.isin(labels, model.classes_)
+    else:
+        new = np.array([key not in trained_keys for key in keys], dtype=bool)
+    if not new.any():
+        return model, 'no new samples'
+
+    new_classes = sorted(set(labels[new]) - set(model.classes_))
+    if is_forest(model) and len(model.estimators_) + added_trees > max_trees:
+        model = clone(model).set_params(n_estimators=min(REFIT_TREES, max_trees))
+        model.fit(data, labels)
+        return model, f'{int(new.sum())} new samples, over {max_trees} trees, refit with {model.n_estimators}'
+    if not new_classes and is_forest(model):
+        # Existing trees stay as they are; only the added ones are fitted, on all samples
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + added_trees)
+        model.fit(data, labels)
+        model.set_params(warm_start=False)
+        return model, f'{int(new.sum())} new samples, added {added_trees} trees'
+
+    # A new class changes the output of every tree, so refit with the current hyperparameters
+    model = clone(model)
+    model.fit(data, labels)
+    return model, f"{int(new.sum())} new samples, new classes {', '.join(map(str, new_classes))}, refit"
+
+
+def parse_names(names):
+    parsed = {}
+    for item in names:
+        class_id, _, name = item.partition('=')
+        if not name:
+            raise ValueError(f"Expected CLASS=NAME, got '{item}'")
+        parsed[int(class_id)] = name
+    return parsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Update model.p/model.npz with samples added to the feature store since it was trained, '
+                    'e.g. by collect_imgs.py --stream --first-class 17 --classes 1')
+    parser.add_argument('--name', action='append', default=[], metavar='CLASS=NAME',
+                        help="gesture name for a class in labels.json, e.g. --name '17=thumbs up'")
+    parser.add_argument('--trees', type=int, default=ADDED_TREES,
+                        help='trees to add when only known gestures got new samples')
+    parser.add_argument('--max-trees', type=int, default=MAX_TREES,
+                        help=f'refit with {REFIT_TREES} trees instead once the forest would grow past this')
+    args = parser.parse_args()
+    names = parse_names(args.name)
+
+    start = time.perf_counter()
+    store = FeatureStore(FEATURE_STORE_DIR)
+    data, labels, keys = store.load(with_keys=True)
+    # model.p, not model.npz: a compiled forest cannot be refitted
+    model = load_model('model.p')
+    model, summary = update_model(model, data, labels, keys, load_trained_keys(), args.trees, args.max_trees)
+
+    labels_dict = save_model(model, names)
+    save_trained_keys(keys)
+    write_dataset(store)
+    print(f'{summary} in {time.perf_counter() - start:.1f} s; {len(labels_dict)} gestures:')
+    for class_id, name in sorted(labels_dict.items()):
+        print(f'  {class_id}: {name}')